@@ -1,10 +1,19 @@
-from pathlib import Path
+import os
 
 import customtkinter
 
+from font_catalog import FontCatalog
+from output_profiles import DEFAULT_PROFILE, OUTPUT_PROFILES
 
-class ControlsFrame(customtkinter.CTkFrame):
+
+# Width of the widest controls, the save location entry and its padding
+CONTROLS_WIDTH = 355
+
+
+class ControlsFrame(customtkinter.CTkScrollableFrame):
     def __init__(self, *args, **kwargs):
+        # The controls are taller than the window, so they scroll vertically at the full width of their widest row
+        kwargs.setdefault("width", CONTROLS_WIDTH)
         super().__init__(*args, **kwargs)
 
         # Setup Tab view that contains text and image watermark widgets
@@ -46,9 +55,8 @@ class ControlsFrame(customtkinter.CTkFrame):
         self.text_color_chooser_btn.grid(row=2, column=0, columnspan=2, padx=5, pady=5, sticky="ew")
 
         self.selected_font = customtkinter.StringVar()
-        self.fonts = []
-        for font in list(Path("fonts").iterdir()):
-            self.fonts.append(font.stem)
+        self.font_catalog = FontCatalog()
+        self.fonts = self.font_catalog.names
         self.font_option_menu = customtkinter.CTkOptionMenu(
             self.text_watermark_tab, values=self.fonts, state="disabled"
         )
@@ -63,6 +71,7 @@ class ControlsFrame(customtkinter.CTkFrame):
             ("Bottom-Right", "bottom-right"),
             ("Top-Right", "top-right"),
             ("Center", "center"),
+            ("Tiled", "tiled"),
         ]
 
         self.watermark_position = customtkinter.StringVar()
@@ -100,11 +109,25 @@ class ControlsFrame(customtkinter.CTkFrame):
         self.watermark_opacity_slider.set(100)
         self.watermark_opacity_slider.grid(row=8, column=0, columnspan=2, padx=10, pady=(0, 10), sticky="ew")
 
+        # Tile sliders only apply to the "Tiled" position
+        customtkinter.CTkLabel(self, text="Tile Spacing").grid(row=9, column=0, padx=15, sticky="w")
+        customtkinter.CTkLabel(self, text="Tile Angle").grid(row=9, column=1, padx=15, sticky="w")
+        self.tile_spacing_slider = customtkinter.CTkSlider(
+            self, from_=0, to=500, orientation="horizontal", state="disabled", width=150
+        )
+        self.tile_spacing_slider.set(100)
+        self.tile_spacing_slider.grid(row=10, column=0, padx=10, pady=(0, 10), sticky="ew")
+        self.tile_angle_slider = customtkinter.CTkSlider(
+            self, from_=-90, to=90, number_of_steps=36, orientation="horizontal", state="disabled", width=150
+        )
+        self.tile_angle_slider.set(30)
+        self.tile_angle_slider.grid(row=10, column=1, padx=10, pady=(0, 10), sticky="ew")
+
         self.save_location_btn = customtkinter.CTkButton(self, text="Save Location", state="disabled")
-        self.save_location_btn.grid(row=9, column=0, padx=10, pady=10)
+        self.save_location_btn.grid(row=11, column=0, padx=10, pady=10)
         self.save_location_entry = customtkinter.CTkEntry(self, placeholder_text="/output", width=325, state="readonly")
         self.save_location_entry.grid(
-            row=10,
+            row=12,
             column=0,
             columnspan=2,
             padx=15,
@@ -112,16 +135,37 @@ class ControlsFrame(customtkinter.CTkFrame):
             sticky="ew",
         )
 
-        customtkinter.CTkLabel(self, text="Selected Image Options").grid(row=11, column=0, padx=15, sticky="w")
+        customtkinter.CTkLabel(self, text="Selected Image Options").grid(row=13, column=0, padx=15, sticky="w")
         self.rotate_image_btn = customtkinter.CTkButton(self, text="Rotate", state="disabled")
-        self.rotate_image_btn.grid(row=12, column=0, padx=10, pady=(0, 10))
+        self.rotate_image_btn.grid(row=14, column=0, padx=10, pady=(0, 10))
         self.delete_image_btn = customtkinter.CTkButton(self, text="Delete", state="disabled")
-        self.delete_image_btn.grid(row=12, column=1, padx=10, pady=(0, 10))
+        self.delete_image_btn.grid(row=14, column=1, padx=10, pady=(0, 10))
 
-        customtkinter.CTkLabel(self, text="Global Image Options").grid(row=13, column=0, padx=15, sticky="w")
+        customtkinter.CTkLabel(self, text="Global Image Options").grid(row=15, column=0, padx=15, sticky="w")
         self.add_image_btn = customtkinter.CTkButton(self, text="Add Image(s)")
-        self.add_image_btn.grid(row=14, column=1, padx=10, pady=(0, 10))
+        self.add_image_btn.grid(row=16, column=1, padx=10, pady=(0, 10))
         self.delete_all_image_btn = customtkinter.CTkButton(self, text="Delete All", state="disabled")
-        self.delete_all_image_btn.grid(row=14, column=0, padx=10, pady=(0, 10))
+        self.delete_all_image_btn.grid(row=16, column=0, padx=10, pady=(0, 10))
+
+        # Number of worker processes used to export images in parallel. Defaults to one per CPU core.
+        customtkinter.CTkLabel(self, text="Export Workers:").grid(row=17, column=0, padx=15, sticky="w")
+        self.export_workers = [str(workers) for workers in range(1, (os.cpu_count() or 1) + 1)]
+        self.export_workers_option_menu = customtkinter.CTkOptionMenu(self, values=self.export_workers, width=100)
+        self.export_workers_option_menu.grid(row=17, column=1, padx=10, pady=(0, 5))
+        self.export_workers_option_menu.set(self.export_workers[-1])
+
+        # Format and encoder settings of the saved images
+        customtkinter.CTkLabel(self, text="Output Format:").grid(row=18, column=0, padx=15, sticky="w")
+        self.output_profiles = [profile.label for profile in OUTPUT_PROFILES.values()]
+        self.output_profile_option_menu = customtkinter.CTkOptionMenu(self, values=self.output_profiles, width=100)
+        self.output_profile_option_menu.grid(row=18, column=1, padx=10, pady=(0, 5))
+        self.output_profile_option_menu.set(DEFAULT_PROFILE.label)
+
         self.save_images_btn = customtkinter.CTkButton(self, text="Save All Images", state="disabled")
-        self.save_images_btn.grid(row=15, column=0, columnspan=2, padx=18, pady=10, sticky="ew")
+        self.save_images_btn.grid(row=19, column=0, columnspan=2, padx=18, pady=10, sticky="ew")
+
+        # Job files store the watermark settings, output options and images so a batch can be run again later
+        self.load_job_btn = customtkinter.CTkButton(self, text="Load Job")
+        self.load_job_btn.grid(row=20, column=0, padx=10, pady=(0, 10))
+        self.save_job_btn = customtkinter.CTkButton(self, text="Save Job", state="disabled")
+        self.save_job_btn.grid(row=20, column=1, padx=10, pady=(0, 10))
@@ -0,0 +1,219 @@
+import queue
+import tkinter as tk
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import ImageTk
+
+from DoubleScrolledFrame import DoubleScrolledFrame
+
+
+class ThumbnailStrip(DoubleScrolledFrame):
+    """
+    A horizontally scrolled strip of image thumbnail buttons drawn on the canvas of a DoubleScrolledFrame.
+    The strip is virtualized: only the buttons inside the visible part of the canvas, plus a few on each
+    side (overscan), exist at any time. Buttons scrolled out of view are recycled for the images scrolled
+    into view, and thumbnails are loaded in the background the first time they are needed, so the number
+    of widgets and PhotoImages stays the same whether the strip holds 100 or 50,000 images.
+
+    load_thumbnail is called with an image path on a background thread and must return a PIL Image no
+    bigger than thumbnail_size. on_click is called with the image path when a thumbnail is clicked.
+    """
+
+    def __init__(
+        self,
+        master,
+        load_thumbnail,
+        on_click,
+        thumbnail_size=(125, 125),
+        padding=10,
+        overscan=4,
+        cache_size=256,
+        **kwargs,
+    ):
+        super().__init__(master, frame="image_preview", **kwargs)
+        self.load_thumbnail = load_thumbnail
+        self.on_click = on_click
+        self.thumbnail_size = thumbnail_size
+        self.padding = padding
+        self.overscan = overscan
+        self.cache_size = cache_size
+        self.slot_width = thumbnail_size[0] + 2 * padding
+        self.button_state = "normal"
+
+        # Ordered image paths shown in the strip, and the version of each path's thumbnail. The version is
+        # increased by refresh so thumbnails that were loading while the image changed are ignored.
+        self.paths = []
+        self._path_set = set()
+        self._versions = {}
+
+        # Recently used thumbnails as {path: (version, PhotoImage)}, oldest first
+        self._photos = OrderedDict()
+        self._placeholder = tk.PhotoImage(master=self.canvas, width=thumbnail_size[0], height=thumbnail_size[1])
+
+        # Buttons currently shown as {slot index: (canvas window id, Button)} and hidden buttons ready for reuse
+        self._visible = {}
+        self._free = []
+
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="ThumbnailStrip")
+        self._loading = set()
+        self._loaded = queue.Queue()
+        self._polling = False
+
+        # Lay out the visible buttons again whenever the view scrolls or the canvas is resized
+        self.canvas["xscrollcommand"] = self._on_xscroll
+        self.canvas.bind("<Configure>", lambda event: self.layout(), add="+")
+
+    def add(self, path, thumbnail=None):
+        """Appends an image to the end of the strip. thumbnail is an optional PIL Image to show right away
+        instead of loading it in the background when the image is added in view."""
+        self.paths.append(path)
+        self._path_set.add(path)
+        # Thumbnails of images added out of view are dropped and loaded again once they're scrolled to, so
+        # adding thousands of images doesn't create thousands of PhotoImages
+        if thumbnail is not None and len(self.paths) - 1 <= self._get_visible_range()[1]:
+            self._store_photo(path, thumbnail)
+        self._update_scrollregion()
+        self.layout()
+
+    def remove(self, path):
+        """Removes an image from the strip. Buttons after it move one slot to the left."""
+        if path not in self._path_set:
+            return
+        self.paths.remove(path)
+        self._path_set.discard(path)
+        self._versions.pop(path, None)
+        self._photos.pop(path, None)
+        self._update_scrollregion()
+        self.layout(force=True)
+
+    def refresh(self, path, thumbnail=None):
+        """Reloads the thumbnail of an image that changed, e.g. after it was rotated. Only its own button,
+        if visible, is updated."""
+        self._versions[path] = self._versions.get(path, 0) + 1
+        self._photos.pop(path, None)
+        if thumbnail is not None:
+            self._store_photo(path, thumbnail)
+        for index, (window_id, button) in self._visible.items():
+            if self.paths[index] == path:
+                self._show(index, window_id, button)
+
+    def clear(self):
+        """Removes every image from the strip."""
+        self.paths.clear()
+        self._path_set.clear()
+        self._versions.clear()
+        self._photos.clear()
+        self._update_scrollregion()
+        self.layout(force=True)
+
+    def set_button_state(self, state):
+        """Sets the state ("normal", "active" or "disabled") of every thumbnail button, including the ones
+        created later when scrolling."""
+        self.button_state = state
+        for _, button in self._visible.values():
+            button.configure(state=state)
+
+    def layout(self, force=False):
+        """Shows buttons for the images in the visible part of the strip, recycling the buttons of images
+        that scrolled out of view. With force, every visible button is updated, e.g. after removing an image
+        shifted the images after it."""
+        first, last = self._get_visible_range()
+        for index in [index for index in self._visible if not first <= index <= last or force]:
+            window_id, button = self._visible.pop(index)
+            self.canvas.itemconfigure(window_id, state="hidden")
+            self._free.append((window_id, button))
+
+        for index in range(first, last + 1):
+            if index in self._visible:
+                continue
+            if self._free:
+                window_id, button = self._free.pop()
+            else:
+                button = tk.Button(self.canvas, borderwidth=0, text="")
+                window_id = self.canvas.create_window(0, 0, window=button, anchor="nw")
+            self._visible[index] = (window_id, button)
+            self._show(index, window_id, button)
+
+    def destroy(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self.outer.destroy()
+
+    def _get_visible_range(self):
+        left = self.canvas.canvasx(0)
+        width = max(self.canvas.winfo_width(), int(self.canvas["width"]))
+        first = max(0, int(left // self.slot_width) - self.overscan)
+        last = min(len(self.paths) - 1, int((left + width) // self.slot_width) + self.overscan)
+        return first, last
+
+    def _show(self, index, window_id, button):
+        path = self.paths[index]
+        button.configure(
+            image=self._get_photo(path),
+            state=self.button_state,
+            command=lambda path=path: self.on_click(path),
+        )
+        self.canvas.coords(window_id, index * self.slot_width + self.padding, 5)
+        self.canvas.itemconfigure(window_id, state="normal")
+
+    def _get_photo(self, path):
+        version = self._versions.get(path, 0)
+        cached = self._photos.get(path)
+        if cached and cached[0] == version:
+            self._photos.move_to_end(path)
+            return cached[1]
+
+        # Show an empty placeholder until the thumbnail is loaded in the background
+        if (path, version) not in self._loading:
+            self._loading.add((path, version))
+            future = self._executor.submit(self.load_thumbnail, path)
+            future.add_done_callback(lambda future, key=(path, version): self._loaded.put((key, future)))
+            self._start_polling()
+        return self._placeholder
+
+    def _store_photo(self, path, thumbnail):
+        self._photos[path] = (self._versions.get(path, 0), ImageTk.PhotoImage(thumbnail, master=self.canvas))
+        self._photos.move_to_end(path)
+        while len(self._photos) > self.cache_size:
+            self._photos.popitem(last=False)
+
+    def _start_polling(self):
+        if not self._polling:
+            self._polling = True
+            self.canvas.after(30, self._poll)
+
+    def _poll(self):
+        # PhotoImages must be created on the Tk thread, so loaded thumbnails are handed over through a queue
+        while True:
+            try:
+                (path, version), future = self._loaded.get_nowait()
+            except queue.Empty:
+                break
+            self._loading.discard((path, version))
+            if future.cancelled() or path not in self._path_set or self._versions.get(path, 0) != version:
+                continue
+            if future.exception():
+                # Keep the placeholder for images that can't be read instead of trying again on every scroll
+                print(f"Could not load thumbnail of {path}: {future.exception()}")
+                self._photos[path] = (version, self._placeholder)
+                continue
+            self._store_photo(path, future.result())
+            for index, (window_id, button) in self._visible.items():
+                if self.paths[index] == path:
+                    button.configure(image=self._photos[path][1])
+
+        if self._loading:
+            self.canvas.after(30, self._poll)
+        else:
+            self._polling = False
+
+    def _on_xscroll(self, first, last):
+        self.hsb.set(first, last)
+        self.layout()
+
+    def _on_frame_configure(self, event=None):
+        self._update_scrollregion()
+
+    def _update_scrollregion(self):
+        width = max(len(self.paths) * self.slot_width, self.canvas.winfo_width())
+        self.canvas.config(scrollregion=(0, 0, width, self.thumbnail_size[1] + 10))
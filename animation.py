@@ -0,0 +1,211 @@
+"""Watermarking of animated GIF, WebP and PNG images.
+
+Every frame of an animation is decoded, watermarked and encoded one at a time, so exporting a long animated banner
+needs memory for a few frames rather than for all of them, and takes time proportional to its frame count. The
+watermark sprite is prepared once and reused for every frame through the caches of the watermark engine.
+
+Animated GIFs are written by a streaming writer that hands each frame to the file as soon as it is watermarked. Only
+the region that changed since the previous frame is stored, like in the GIF encoder of PIL, which itself keeps every
+frame in memory until the end. Animated WebP and PNG outputs go through the PIL encoders: WebP frames are fed to it
+lazily but still collected before encoding, and APNG needs every watermarked frame at once, so prefer GIF for long
+animations.
+"""
+from pathlib import Path
+
+from PIL import GifImagePlugin, Image, ImageChops
+
+import telemetry
+from output_profiles import get_metadata, open_output
+from watermark_engine import composite_watermark, get_exif_rotation, rotate_image
+
+# Output formats that can store an animation
+ANIMATION_FORMATS = {"GIF", "WEBP", "PNG"}
+
+# Palette index used for the transparent pixels of a GIF frame, the other 255 entries hold its colors
+GIF_TRANSPARENT_INDEX = 255
+
+# GIF disposal methods: keep the frame on screen, or clear it to transparent before drawing the next frame
+GIF_DISPOSAL_KEEP = 1
+GIF_DISPOSAL_CLEAR = 2
+
+
+def get_animation_format(image_path, profile):
+    """Returns the format the watermarked copy of an animated image is saved in.
+
+    Args:
+        image_path (str): Full path of the source image.
+        profile (OutputProfile): Profile the image is saved with.
+
+    Returns:
+        str: PIL format name of the output, None if the image isn't animated or the profile saves it in a format that
+        can't store an animation, e.g. JPEG. Such images are exported as a still image of their first frame.
+    """
+    output_format = profile.get_format(image_path)
+    source_format = Image.registered_extensions().get(Path(image_path).suffix.lower())
+    # Only open files that can hold an animation at all, so still images cost no extra read
+    if output_format not in ANIMATION_FORMATS or source_format not in ANIMATION_FORMATS:
+        return None
+    try:
+        with Image.open(image_path) as image:
+            is_animated = getattr(image, "is_animated", False)
+    except Exception:
+        return None
+    return output_format if is_animated else None
+
+
+def iter_frames(image, spec, rotate=0, timer=None):
+    """Decodes and watermarks the frames of an opened animated image one at a time.
+
+    Args:
+        image (PIL Image): Opened animated image. It is seeked through its frames.
+        spec (WatermarkSpec): Description of the watermark to apply.
+        rotate (int, optional): Counter-clockwise rotation in degrees. Defaults to 0.
+        timer (StageTimer, optional): Adds the time spent on every frame to the stages of the image when telemetry is
+            on. Defaults to None.
+
+    Yields:
+        tuple: (watermarked RGBA frame, display duration of the frame in milliseconds).
+    """
+    index = 0
+    while True:
+        with telemetry.stage(timer, "decode"):
+            try:
+                image.seek(index)
+            except EOFError:
+                break
+            image.load()
+        duration = image.info.get("duration", 0)
+        # The decoder draws every frame over the previous one, so the frame must be copied before seeking further
+        with telemetry.stage(timer, "convert"):
+            frame = image.convert("RGBA")
+        with telemetry.stage(timer, "rotate"):
+            frame = rotate_image(frame, rotate)
+        with telemetry.stage(timer, "composite"):
+            composite_watermark(frame, spec)
+        yield frame, duration
+        index += 1
+    if timer is not None:
+        timer.details["frames"] = index
+
+
+def export_animation(image_path, rotate, spec, output_path, profile, timer=None):
+    """Watermarks every frame of an animated image and saves the animation to output_path, keeping the frame
+    durations and loop count of the source.
+
+    Args:
+        image_path (str): Full path of the animated image to export.
+        rotate (int): Counter-clockwise rotation in degrees. None uses the EXIF orientation of the image.
+        spec (WatermarkSpec): Description of the watermark to apply.
+        output_path (str): Full path the watermarked animation is saved to.
+        profile (OutputProfile): Format and encoder settings to save with. Its format must be in ANIMATION_FORMATS.
+        timer (StageTimer, optional): Records the stage times of the export when telemetry is on. Defaults to None.
+    """
+    output_format = profile.get_format(image_path)
+    with Image.open(image_path) as image:
+        if rotate is None:
+            rotate = get_exif_rotation(image)
+        if timer is not None:
+            timer.details.update(format=image.format, mode=image.mode, width=image.width, height=image.height)
+        loop = image.info.get("loop")
+        frames = iter_frames(image, spec, rotate, timer)
+        with open_output(output_path) as file:
+            if output_format == "GIF":
+                write_gif(file, frames, loop, timer)
+            else:
+                metadata = get_metadata(image, "RGBA", rotate)
+                _save_all(file, frames, output_format, loop, metadata, profile.save_options, timer)
+
+
+def write_gif(file, frames, loop=None, timer=None):
+    """Writes an animated GIF one frame at a time. Only the previous frame is kept in memory, to store just the region
+    that changed. Frames with transparent pixels are stored whole, after clearing the frame before them.
+
+    Args:
+        file (file): Binary file the GIF is written to.
+        frames (iterable): (RGBA frame, duration in milliseconds) tuples, e.g. from iter_frames.
+        loop (int, optional): Number of times the animation repeats, 0 forever. None plays it once. Defaults to None.
+        timer (StageTimer, optional): Records the encode time when telemetry is on. Defaults to None.
+    """
+    previous = None
+    # Every frame is written once the next one is known, as its disposal depends on whether the next one is opaque
+    pending = None
+    for frame, duration in frames:
+        with telemetry.stage(timer, "encode"):
+            is_opaque = frame.getextrema()[3][0] == 255
+            if previous is None or not is_opaque:
+                box = (0, 0) + frame.size
+            else:
+                # A frame identical to the previous one still needs a pixel to carry its duration
+                box = ImageChops.difference(previous, frame).getbbox(alpha_only=False) or (0, 0, 1, 1)
+            if previous is None:
+                # Every frame brings its own palette, so the global one only needs to fit the canvas size
+                header, _ = GifImagePlugin.getheader(
+                    Image.new("P", frame.size), info={} if loop is None else {"loop": loop}
+                )
+                file.write(b"".join(header))
+            else:
+                _write_gif_frame(file, *pending, GIF_DISPOSAL_KEEP if is_opaque else GIF_DISPOSAL_CLEAR)
+            pending = (frame.crop(box) if box != (0, 0) + frame.size else frame, box[:2], duration)
+            previous = frame
+    if pending:
+        with telemetry.stage(timer, "encode"):
+            _write_gif_frame(file, *pending, GIF_DISPOSAL_KEEP)
+    # Trailer
+    file.write(b";")
+
+
+def _write_gif_frame(file, frame, offset, duration, disposal):
+    paletted, transparency = _quantize(frame)
+    params = {"duration": duration, "disposal": disposal, "include_color_table": True}
+    if transparency is not None:
+        params["transparency"] = transparency
+    file.write(b"".join(GifImagePlugin.getdata(paletted, offset, **params)))
+
+
+def _quantize(frame):
+    # Every frame gets its own palette, with one entry saved for transparency if the frame needs it. Fast octree is
+    # what PIL itself uses for RGBA frames, and several times faster than the default median cut.
+    alpha = frame.getchannel("A")
+    if alpha.getextrema()[0] == 255:
+        return frame.convert("RGB").quantize(256, method=Image.Quantize.FASTOCTREE), None
+    paletted = frame.convert("RGB").quantize(GIF_TRANSPARENT_INDEX, method=Image.Quantize.FASTOCTREE)
+    palette = paletted.getpalette()
+    paletted.putpalette(palette + [0] * (GIF_TRANSPARENT_INDEX * 3 - len(palette)) + [0, 0, 0])
+    paletted.paste(GIF_TRANSPARENT_INDEX, mask=alpha.point(lambda value: 255 if value < 128 else 0))
+    return paletted, GIF_TRANSPARENT_INDEX
+
+
+def _save_all(file, frames, output_format, loop, metadata, save_options, timer):
+    frames = iter(frames)
+    first, duration = next(frames)
+    durations = [duration]
+
+    def iter_append_images():
+        # Durations are collected as the encoder asks for the frames, it only looks them up once it has a frame
+        for frame, frame_duration in frames:
+            durations.append(frame_duration)
+            yield frame
+
+    append_images = iter_append_images()
+    if output_format == "PNG":
+        # The APNG encoder of PIL goes through the frames twice, so it needs all of them at once
+        append_images = list(append_images)
+
+    def get_frame_time():
+        return sum(seconds for name, seconds in timer.stages.items() if name != "encode") if timer else 0.0
+
+    frame_time = get_frame_time()
+    with telemetry.stage(timer, "encode"):
+        first.save(
+            file,
+            format=output_format,
+            save_all=True,
+            append_images=append_images,
+            duration=durations,
+            # A GIF without a loop count plays once, the other formats would repeat it forever
+            loop=1 if loop is None else loop,
+            **{**save_options, **metadata},
+        )
+    if timer:
+        # The frames are decoded and watermarked while the encoder runs, so don't count that time twice
+        timer.stages["encode"] -= get_frame_time() - frame_time
@@ -0,0 +1,543 @@
+"""Parallel batch export of watermarked images.
+
+Images are watermarked and encoded on a process pool so a batch can use every core instead of a single thread. Work
+is submitted a few images at a time, so the input can be a lazy stream of any length, a cancelled run stops quickly,
+and a failing image is reported without aborting the rest of the batch.
+
+With a single worker the export runs as a pipeline of decode, watermark and encode stages on their own threads,
+connected by bounded queues, so reading and writing files overlaps with compositing. In both cases the images in
+flight are limited by a memory budget, so peak memory stays predictable however many and however large the images are.
+Animated images are exported a frame at a time by the animation module, as a single step of the pipeline.
+"""
+import multiprocessing
+import os
+import queue
+import signal
+import threading
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from PIL import Image
+
+import animation
+import large_image
+import telemetry
+import watermark_engine
+from export_manifest import ExportManifest, get_settings_hash
+from output_profiles import DEFAULT_PROFILE
+from telemetry import Telemetry
+
+# Number of tasks kept queued per worker so workers never wait for the next image
+TASKS_PER_WORKER = 2
+
+# Default memory budget in bytes for the decoded images of a batch that are in flight at the same time
+DEFAULT_MEMORY_BUDGET = 1024 * 1024 * 1024
+
+# Number of images waiting between two stages of the single worker pipeline
+STAGE_QUEUE_SIZE = 2
+
+# Yielded by a task stream that has no image ready yet but isn't over, e.g. a watched folder
+NO_TASK = object()
+
+# Marks the end of the stream between two pipeline stages
+_END = object()
+
+
+@dataclass
+class ExportResult:
+    """Outcome of exporting a single image.
+
+    Attributes:
+        image_path (str): Full path of the source image.
+        output_path (str): Full path of the saved watermarked image, None if the export failed.
+        error (str): Description of the error that stopped the export, None if it succeeded.
+        skipped (bool): True if the image wasn't exported again because its output was already up to date.
+        stats (dict): Stage timings and details of the export when telemetry is on, otherwise None.
+        replaced (list): Full paths of other sources whose earlier export to output_path this export replaced.
+    """
+
+    image_path: str
+    output_path: str = None
+    error: str = None
+    skipped: bool = False
+    stats: dict = None
+    replaced: list = field(default_factory=list)
+
+    @property
+    def ok(self):
+        """bool: True if the image was exported successfully."""
+        return self.error is None
+
+
+def get_output_path(image_path, save_location, profile=DEFAULT_PROFILE):
+    """Builds the path a watermarked copy of image_path is saved to.
+
+    Args:
+        image_path (str): Full path of the source image.
+        save_location (str): Folder where watermarked images are saved.
+        profile (OutputProfile, optional): Profile the image is saved with. Defaults to keeping the original format.
+
+    Returns:
+        Path: Path of the watermarked image, keeping the original name of the source image.
+    """
+    image_path = Path(image_path)
+    return Path(save_location) / f"{image_path.stem}_watermarked{profile.get_suffix(image_path)}"
+
+
+def get_failure(image_path, error):
+    """Builds the ExportResult of an image that failed to export with error."""
+    return ExportResult(image_path=str(image_path), error=f"{type(error).__name__}: {error}")
+
+
+def estimate_memory(image_path, profile=DEFAULT_PROFILE):
+    """Estimates the peak memory needed to export an image from its header, without decoding it.
+
+    Args:
+        image_path (str): Full path of the image.
+        profile (OutputProfile, optional): Profile the image is saved with. Defaults to DEFAULT_PROFILE.
+
+    Returns:
+        int: Estimated size in bytes of the decoded image and the copies made while watermarking and rotating it, 0 if
+        the image can't be opened. Such an image fails quickly on export anyway.
+    """
+    try:
+        with Image.open(image_path) as image:
+            pixels = image.width * image.height
+            bands = len(image.getbands())
+            is_rgb = image.mode == "RGB"
+            is_animated = getattr(image, "is_animated", False)
+            frames = getattr(image, "n_frames", 1)
+    except Exception:
+        return 0
+    if is_animated:
+        # Animations are exported a frame at a time, holding the decoded frame and a few RGBA copies of it. Only GIFs
+        # are streamed to the file, the WebP and APNG encoders collect every watermarked RGBA frame before encoding.
+        frame_memory = pixels * 4 * 4
+        if animation.get_animation_format(image_path, profile) in ("WEBP", "PNG"):
+            return frame_memory + pixels * 4 * frames
+        return frame_memory
+    # RGB images are watermarked in place, so only a rotated copy can be added. Other modes also go through an RGBA
+    # copy and an RGB conversion for saving.
+    if is_rgb:
+        return pixels * 3 * 2
+    return pixels * (bands * 2 + 4 + 3)
+
+
+class MemoryBudget:
+    """Limits the total estimated memory of the images in flight. Safe to use from several threads.
+
+    A single image larger than the whole budget is still let through once nothing else is in flight, so a batch never
+    gets stuck on it.
+
+    Args:
+        limit (int): Budget in bytes.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    def try_acquire(self, size):
+        """Reserves size bytes if they fit in the budget right now.
+
+        Returns:
+            bool: True if the bytes were reserved.
+        """
+        with self._condition:
+            if self.used and self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+
+    def acquire(self, size, cancel_event):
+        """Waits until size bytes fit in the budget and reserves them.
+
+        Args:
+            size (int): Bytes to reserve.
+            cancel_event (threading.Event): Stops waiting once set.
+
+        Returns:
+            bool: True if the bytes were reserved, False if the wait was cancelled.
+        """
+        with self._condition:
+            while self.used and self.used + size > self.limit:
+                if cancel_event.is_set():
+                    return False
+                self._condition.wait(0.2)
+            self.used += size
+            return True
+
+    def release(self, size):
+        """Gives back size bytes reserved with acquire or try_acquire."""
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
+
+
+def export_image(image_path, rotate, spec, save_location, profile=DEFAULT_PROFILE, timed=False, large_images=False):
+    """Watermarks a single image and saves it to save_location. This runs inside the worker processes, so it only
+    relies on its arguments.
+
+    Args:
+        image_path (str): Full path of the image to export.
+        rotate (int): Counter-clockwise rotation in degrees stored for the image. None uses its EXIF orientation.
+        spec (WatermarkSpec): Description of the watermark to apply.
+        save_location (str): Folder where the watermarked image is saved.
+        profile (OutputProfile, optional): Format and encoder settings to save with. Defaults to keeping the original
+            format.
+        timed (bool, optional): Record the stage timings of the export in the result stats. Defaults to False.
+        large_images (bool, optional): Export in large image mode, see the large_image module. Defaults to False.
+
+    Returns:
+        ExportResult: The result of the export.
+    """
+    timer = None
+    if timed:
+        # Worker processes export one image at a time, so the peak memory can be measured per image
+        telemetry.reset_peak_memory()
+        timer = telemetry.StageTimer()
+    output_path = get_output_path(image_path, save_location, profile)
+    try:
+        with large_image.allow_large_images() if large_images else nullcontext():
+            if not export_streamed(image_path, rotate, spec, output_path, profile, large_images, timer):
+                image = watermark_engine.load_image(image_path, rotate, timer)
+                # Only keep the alpha channel if the output format can store it, e.g. JPEG can't
+                mode = profile.get_mode(image, image_path)
+                watermarked_image = watermark_engine.watermark_image(image, spec, mode, timer)
+                with telemetry.stage(timer, "encode"):
+                    profile.save(watermarked_image, output_path, rotate)
+        result = ExportResult(image_path=str(image_path), output_path=str(output_path))
+    except Exception as error:
+        result = get_failure(image_path, error)
+    return timer.finish(result) if timer else result
+
+
+def _ignore_interrupts():
+    # Ctrl+C reaches every process of the group, leave it to the main process to stop the batch
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def export_streamed(image_path, rotate, spec, output_path, profile, large_images=False, timer=None):
+    """Exports the images that are never decoded whole: animations, and uncompressed images in large image mode.
+
+    Args:
+        image_path (str): Full path of the image to export.
+        rotate (int): Counter-clockwise rotation in degrees stored for the image. None uses its EXIF orientation.
+        spec (WatermarkSpec): Description of the watermark to apply.
+        output_path (str): Full path the watermarked image is saved to.
+        profile (OutputProfile): Format and encoder settings to save with.
+        large_images (bool, optional): Patch uncompressed images instead of decoding them. Defaults to False.
+        timer (StageTimer, optional): Records the stage times of the export when telemetry is on. Defaults to None.
+
+    Returns:
+        bool: True if the image was exported, False if it has to be decoded, watermarked and encoded as a whole.
+    """
+    if large_images and large_image.can_patch(image_path, rotate, profile):
+        large_image.patch_watermark(image_path, spec, output_path, timer)
+        return True
+    if animation.get_animation_format(image_path, profile):
+        animation.export_animation(image_path, rotate, spec, output_path, profile, timer)
+        return True
+    return False
+
+
+class BatchExporter:
+    """Exports a batch of images with the same watermark on a pool of worker processes.
+
+    Args:
+        spec (WatermarkSpec): Description of the watermark to apply to every image.
+        save_location (str): Folder where watermarked images are saved.
+        workers (int, optional): Number of worker processes. Defaults to the number of CPUs. A value of 1 exports
+            the images with a pipeline of threads without starting a process pool.
+        memory_budget (int, optional): Maximum estimated memory in bytes of the images in flight at the same time.
+            Defaults to DEFAULT_MEMORY_BUDGET.
+        profile (OutputProfile, optional): Format and encoder settings images are saved with. Defaults to keeping the
+            original format of each image.
+        resume (bool, optional): Skip images whose output in save_location is already up to date according to the
+            export manifest. Exported images are recorded in the manifest either way. Defaults to True.
+        telemetry (Telemetry, optional): Records the stage timings of every exported image and prints a summary at
+            the end of each batch. Defaults to the log set with the WATERMARK_TELEMETRY environment variable, if any.
+        large_images (bool, optional): Export in large image mode, which lifts the decompression bomb guard of PIL and
+            watermarks uncompressed images without decoding them, see the large_image module. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        spec,
+        save_location,
+        workers=None,
+        memory_budget=DEFAULT_MEMORY_BUDGET,
+        profile=DEFAULT_PROFILE,
+        resume=True,
+        telemetry=None,
+        large_images=False,
+    ):
+        self.spec = spec
+        self.save_location = save_location
+        self.profile = profile
+        self.resume = resume
+        self.large_images = large_images
+        # A telemetry started from the environment belongs to this exporter and is closed after the batch
+        self._owns_telemetry = telemetry is None
+        self.telemetry = telemetry or Telemetry.from_environment()
+        self.manifest = None
+        # Source image of every output path of the batch, images with the same name in different folders would
+        # otherwise overwrite each other's output
+        self._outputs = {}
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.memory_budget = MemoryBudget(memory_budget)
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        """bool: True once cancel() has been called."""
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """Requests the running batch to stop. Images that are already being processed are finished, images that
+        were not started yet are skipped. Safe to call from any thread."""
+        self._cancel_event.set()
+
+    def run(self, tasks, on_progress=None):
+        """Exports every image in tasks.
+
+        Args:
+            tasks (iterable): Iterable of (image_path, rotate) tuples. It is consumed lazily so it can be a generator.
+                A rotate of None uses the EXIF orientation of the image. A stream that has nothing ready yet can yield
+                NO_TASK instead, after blocking briefly, and the export keeps running until the stream ends.
+            on_progress (callable, optional): Called on the calling thread with (completed_count, ExportResult)
+                every time an image finishes, whether it succeeded, failed or was skipped.
+
+        Returns:
+            list: ExportResult of every image that failed to export.
+        """
+        Path(self.save_location).mkdir(parents=True, exist_ok=True)
+        self._outputs = {}
+        self.manifest = ExportManifest(self.save_location, get_settings_hash(self.spec, self.profile))
+        try:
+            # Large images have to get through PIL's guard everywhere they are opened, including the memory estimates
+            with large_image.allow_large_images() if self.large_images else nullcontext():
+                if self.workers == 1:
+                    return self._run_serial(tasks, on_progress)
+                return self._run_parallel(tasks, on_progress)
+        finally:
+            self.manifest.close()
+            if self.telemetry and self.telemetry.count:
+                print(self.telemetry.summary())
+            if self.telemetry and self._owns_telemetry:
+                self.telemetry.close()
+
+    def _estimate_memory(self, image_path, rotate):
+        # A patched image only holds a band of its rows in memory, however large it is
+        if self.large_images and large_image.can_patch(image_path, rotate, self.profile):
+            return large_image.PATCH_MEMORY
+        return estimate_memory(image_path, self.profile)
+
+    def _get_skipped(self, image_path, rotate):
+        # Returns the result of an image that isn't exported: up to date, or failed because another image of the batch
+        # is saved to the same output
+        output_path = get_output_path(image_path, self.save_location, self.profile)
+        source = os.path.realpath(image_path)
+        claimed = self._outputs.setdefault(str(output_path), source)
+        if claimed != source:
+            return get_failure(image_path, FileExistsError(f"{claimed} is also saved to {output_path}"))
+        # The manifest is checked for every image, even without resume, so the exports can be recorded afterwards
+        if self.manifest.is_current(image_path, rotate, output_path) and self.resume:
+            return ExportResult(image_path=str(image_path), output_path=str(output_path), skipped=True)
+        return None
+
+    def _run_serial(self, tasks, on_progress):
+        # Each stage hands its images to the next one through a bounded queue. A full queue blocks the stage before
+        # it, so a slow encoder holds back decoding instead of letting decoded images pile up in memory.
+        decoded = queue.Queue(maxsize=STAGE_QUEUE_SIZE)
+        watermarked = queue.Queue(maxsize=STAGE_QUEUE_SIZE)
+        stages = [
+            threading.Thread(target=self._decode_stage, args=(tasks, decoded), name="BatchExporter-decode"),
+            threading.Thread(
+                target=self._watermark_stage, args=(decoded, watermarked), name="BatchExporter-watermark"
+            ),
+        ]
+        for stage in stages:
+            stage.start()
+
+        # The encode stage runs on the calling thread, so on_progress is called on it like in the parallel export
+        failures = []
+        completed = 0
+        try:
+            while True:
+                item = watermarked.get()
+                if item is _END:
+                    break
+                image_path, rotate, size, image, result, timer = item
+                if result is None:
+                    result = self._encode(image_path, rotate, image, timer)
+                if timer:
+                    timer.finish(result)
+                # Drop the image before giving its memory back to the budget
+                del image, item
+                self.memory_budget.release(size)
+                completed += 1
+                self._report(result, completed, failures, on_progress)
+        finally:
+            # Stop the other stages if on_progress raised, draining the queues so no stage stays blocked
+            if any(stage.is_alive() for stage in stages):
+                self.cancel()
+            while any(stage.is_alive() for stage in stages):
+                for stage_queue in (decoded, watermarked):
+                    try:
+                        stage_queue.get_nowait()
+                    except queue.Empty:
+                        pass
+                for stage in stages:
+                    stage.join(0.05)
+        return failures
+
+    def _decode_stage(self, tasks, output):
+        try:
+            for task in tasks:
+                if self.cancelled:
+                    break
+                if task is NO_TASK:
+                    continue
+                image_path, rotate = task
+                skipped = self._get_skipped(image_path, rotate)
+                if skipped:
+                    output.put((image_path, rotate, 0, None, skipped, None))
+                    continue
+                size = self._estimate_memory(image_path, rotate)
+                if not self.memory_budget.acquire(size, self._cancel_event):
+                    break
+                # Stages overlap in this process, so the peak memory of each image includes the images around it
+                timer = telemetry.StageTimer() if self.telemetry else None
+                output_path = get_output_path(image_path, self.save_location, self.profile)
+                try:
+                    # Streamed images go through every stage at once, so they are exported right here
+                    streamed = export_streamed(
+                        image_path, rotate, self.spec, output_path, self.profile, self.large_images, timer
+                    )
+                    if streamed:
+                        image, result = None, ExportResult(str(image_path), str(output_path))
+                    else:
+                        image, result = watermark_engine.load_image(image_path, rotate, timer), None
+                except Exception as error:
+                    image, result = None, get_failure(image_path, error)
+                item = (image_path, rotate, size, image, result, timer)
+                output.put(item)
+                # Don't keep the image alive while waiting for the budget of the next one
+                del image, item
+        finally:
+            output.put(_END)
+
+    def _watermark_stage(self, source, output):
+        while True:
+            item = source.get()
+            if item is _END:
+                break
+            image_path, rotate, size, image, result, timer = item
+            del item
+            if result is None:
+                try:
+                    mode = self.profile.get_mode(image, image_path)
+                    image = watermark_engine.watermark_image(image, self.spec, mode, timer)
+                except Exception as error:
+                    image, result = None, get_failure(image_path, error)
+            output.put((image_path, rotate, size, image, result, timer))
+            image = None
+        output.put(_END)
+
+    def _encode(self, image_path, rotate, image, timer):
+        output_path = get_output_path(image_path, self.save_location, self.profile)
+        try:
+            with telemetry.stage(timer, "encode"):
+                self.profile.save(image, output_path, rotate)
+        except Exception as error:
+            return get_failure(image_path, error)
+        return ExportResult(image_path=str(image_path), output_path=str(output_path))
+
+    def _run_parallel(self, tasks, on_progress):
+        failures = []
+        completed = 0
+        tasks = iter(tasks)
+        max_pending = self.workers * TASKS_PER_WORKER
+        # Workers are spawned rather than forked: a fork taken while another thread, like the Tk thread of the app or a
+        # preview render, holds a lock such as the font cache lock of watermark_engine would deadlock in the child
+        with ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_ignore_interrupts,
+        ) as executor:
+            # Maps each submitted future to the path of the image it exports and its reserved memory
+            pending = {}
+            # Next task with its estimated memory, kept until it fits in the memory budget
+            waiting = None
+            exhausted = False
+            while True:
+                # Keep the pool busy without submitting the whole batch at once or going over the memory budget
+                while not self.cancelled and len(pending) < max_pending:
+                    if waiting is None:
+                        task = None if exhausted else next(tasks, None)
+                        if task is None:
+                            exhausted = True
+                            break
+                        if task is NO_TASK:
+                            break
+                        skipped = self._get_skipped(*task)
+                        if skipped:
+                            completed += 1
+                            self._report(skipped, completed, failures, on_progress)
+                            continue
+                        waiting = (task, self._estimate_memory(*task))
+                    (image_path, rotate), size = waiting
+                    if not self.memory_budget.try_acquire(size):
+                        break
+                    waiting = None
+                    future = executor.submit(
+                        export_image,
+                        image_path,
+                        rotate,
+                        self.spec,
+                        self.save_location,
+                        self.profile,
+                        self.telemetry is not None,
+                        self.large_images,
+                    )
+                    pending[future] = (image_path, size)
+
+                if not pending:
+                    if exhausted or self.cancelled:
+                        break
+                    continue
+
+                done, _ = wait(pending, timeout=0.2, return_when=FIRST_COMPLETED)
+                for future in done:
+                    image_path, size = pending.pop(future)
+                    self.memory_budget.release(size)
+                    try:
+                        result = future.result()
+                    except Exception as error:
+                        # The worker process itself failed, e.g. it was killed while decoding a huge image
+                        result = get_failure(image_path, error)
+                    completed += 1
+                    self._report(result, completed, failures, on_progress)
+
+                if self.cancelled:
+                    for future in list(pending):
+                        if future.cancel():
+                            self.memory_budget.release(pending.pop(future)[1])
+        return failures
+
+    def _report(self, result, completed, failures, on_progress):
+        if self.telemetry and result.stats:
+            self.telemetry.record(result.stats)
+        if not result.ok:
+            failures.append(result)
+            self.manifest.discard(
+                result.image_path, get_output_path(result.image_path, self.save_location, self.profile)
+            )
+        elif not result.skipped:
+            result.replaced = self.manifest.record(result.image_path, result.output_path)
+        if on_progress:
+            on_progress(completed, result)
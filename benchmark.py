@@ -0,0 +1,385 @@
+"""Benchmarks of the import, preview, watermark and export hot paths.
+
+Synthetic images are generated locally at several sizes and formats, so runs are reproducible on any machine without
+shipping sample photos. Every benchmark reports images/s, p50/p95 latency and peak memory, and the results are saved
+as JSON so runs can be compared across commits. Example:
+
+    python -m benchmark --output results.json
+    python -m benchmark --quick --sizes 4000x3000 --formats jpg
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+import PIL
+from PIL import Image, ImageDraw
+
+import compositing
+import image_loader
+import watermark_engine
+from batch_export import export_image
+from font_catalog import FONTS_FOLDER
+from output_profiles import OUTPUT_PROFILES
+from telemetry import get_peak_memory, percentile, reset_peak_memory
+from watermark_engine import POSITIONS, WatermarkSpec
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Same sizes as the image preview and watermark preview frames of the app
+THUMBNAIL_SIZE = (125, 125)
+FINAL_PREVIEW_SIZE = (690, 690)
+
+DEFAULT_SIZES = ((1024, 768), (4000, 3000), (6000, 4000))
+DEFAULT_FORMATS = ("jpg", "png")
+
+# Number of synthetic images generated for each size and format
+IMAGES_PER_SET = 4
+
+BENCHMARKS = ("thumbnail", "preview", "watermark", "export")
+
+
+@dataclass
+class BenchmarkResult:
+    """Timings of one benchmark case.
+
+    Attributes:
+        name (str): Name of the benchmark, e.g. "thumbnail".
+        labels (dict): Parameters of the case, e.g. image size, format, watermark mode and position.
+        count (int): Number of timed calls.
+        images_per_second (float): Timed calls per second.
+        p50_ms (float): Median latency in milliseconds.
+        p95_ms (float): 95th percentile latency in milliseconds.
+        mean_ms (float): Mean latency in milliseconds.
+        peak_memory_mb (float): Peak resident memory of the process while the case ran, None if unknown.
+    """
+
+    name: str
+    labels: dict = field(default_factory=dict)
+    count: int = 0
+    images_per_second: float = 0.0
+    p50_ms: float = 0.0
+    p95_ms: float = 0.0
+    mean_ms: float = 0.0
+    peak_memory_mb: float = None
+
+
+def measure(name, function, items, repeat=1, **labels):
+    """Times function(item) for every item, repeat times, after one untimed warm up call.
+
+    Args:
+        name (str): Name of the benchmark.
+        function (callable): Code path to time, called with a single item.
+        items (list): Arguments function is timed with.
+        repeat (int, optional): Number of passes over items. Defaults to 1.
+        **labels: Parameters of the case stored with the result.
+
+    Returns:
+        BenchmarkResult: The timings of the case.
+    """
+    # The warm up fills the watermark and font caches like the first image of a batch would
+    function(items[0])
+    reset_peak_memory()
+    latencies = []
+    for _ in range(repeat):
+        for item in items:
+            start = time.perf_counter()
+            function(item)
+            latencies.append(time.perf_counter() - start)
+    total = sum(latencies)
+    result = BenchmarkResult(
+        name=name,
+        labels=labels,
+        count=len(latencies),
+        images_per_second=len(latencies) / total if total else 0.0,
+        p50_ms=percentile(latencies, 50) * 1000,
+        p95_ms=percentile(latencies, 95) * 1000,
+        mean_ms=total / len(latencies) * 1000,
+        peak_memory_mb=get_peak_memory(),
+    )
+    label_text = " ".join(f"{key}={value}" for key, value in labels.items())
+    print(
+        f"{name:<10} {label_text:<48} {result.images_per_second:8.1f} images/s"
+        f"  p50 {result.p50_ms:8.1f} ms  p95 {result.p95_ms:8.1f} ms",
+        flush=True,
+    )
+    return result
+
+
+def make_synthetic_image(size, seed=0):
+    """Builds a deterministic photo-like RGB image with smooth gradients and fine detail, so encoders and decoders
+    do a realistic amount of work.
+
+    Args:
+        size (tuple): (width, height) of the image.
+        seed (int, optional): Varies the content between images of the same size. Defaults to 0.
+
+    Returns:
+        PIL Image: The generated RGB image.
+    """
+    shift = seed * 0.05
+    detail = Image.effect_mandelbrot(size, (-2.0 + shift, -1.2, 0.8 + shift, 1.2), 64)
+    horizontal = Image.linear_gradient("L").rotate(90 * (seed % 4)).resize(size)
+    radial = Image.radial_gradient("L").resize(size)
+    return Image.merge("RGB", (detail, horizontal, radial))
+
+
+def make_watermark_image(path):
+    """Saves a semi transparent RGBA logo used for the image watermark benchmarks."""
+    logo = Image.new("RGBA", (600, 300), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(logo)
+    draw.rounded_rectangle((10, 10, 590, 290), radius=40, fill=(255, 255, 255, 160), outline=(0, 0, 0, 255), width=8)
+    draw.ellipse((60, 60, 240, 240), fill=(200, 30, 30, 220))
+    logo.save(path)
+
+
+def generate_images(folder, sizes, formats, count=IMAGES_PER_SET):
+    """Generates count synthetic images for every size and format.
+
+    Returns:
+        dict: {("WIDTHxHEIGHT", format): [image paths]}.
+    """
+    image_sets = {}
+    for size in sizes:
+        size_text = f"{size[0]}x{size[1]}"
+        for image_format in formats:
+            paths = []
+            for index in range(count):
+                path = Path(folder) / f"{size_text}_{index}.{image_format}"
+                image = make_synthetic_image(size, seed=index)
+                # Same kind of files a camera or an editor would produce
+                options = {"quality": 90} if image_format in ("jpg", "jpeg") else {"compress_level": 6}
+                image.save(path, **options)
+                paths.append(str(path))
+            image_sets[(size_text, image_format)] = paths
+    return image_sets
+
+
+def parse_size(value):
+    """Parses an image size given as "WIDTHxHEIGHT"."""
+    try:
+        width, height = (int(part) for part in value.lower().split("x"))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid size {value!r}, use WIDTHxHEIGHT") from None
+    if width < 1 or height < 1:
+        raise argparse.ArgumentTypeError(f"invalid size {value!r}, use WIDTHxHEIGHT")
+    return width, height
+
+
+def run_benchmarks(image_sets, work_folder, benchmarks=BENCHMARKS, repeat=1, quick=False):
+    """Runs the selected benchmarks on every image set.
+
+    Args:
+        image_sets (dict): {("WIDTHxHEIGHT", format): [image paths]} from generate_images.
+        work_folder (str): Folder for the watermark image and exported images.
+        benchmarks (tuple, optional): Names of the benchmarks to run. Defaults to all of them.
+        repeat (int, optional): Number of passes over each image set. Defaults to 1.
+        quick (bool, optional): Only time a single watermark position. Defaults to False.
+
+    Returns:
+        list: BenchmarkResult of every case.
+    """
+    watermark_path = Path(work_folder) / "watermark.png"
+    make_watermark_image(watermark_path)
+    specs = {
+        "image": WatermarkSpec(mode="image", image_watermark_path=str(watermark_path), opacity=60),
+        "text": WatermarkSpec(
+            mode="text", text="(c) Mass Watermarker", font=str(FONTS_FOLDER / "Roboto-Regular.ttf"), opacity=60
+        ),
+    }
+    positions = POSITIONS[:1] if quick else POSITIONS
+    export_folder = Path(work_folder) / "export"
+    export_folder.mkdir(exist_ok=True)
+
+    results = []
+    for (size_text, image_format), paths in image_sets.items():
+        labels = {"size": size_text, "format": image_format}
+
+        if "thumbnail" in benchmarks:
+            # Thumbnail decoding done by the Add Image(s) import, without the on-disk cache
+            results.append(
+                measure(
+                    "thumbnail",
+                    lambda path: image_loader.load_thumbnail(path, THUMBNAIL_SIZE),
+                    paths,
+                    repeat,
+                    **labels,
+                )
+            )
+
+        if "preview" in benchmarks:
+            # Decoding the preview sized copy happens once per selected image, rendering happens on every slider move
+            results.append(
+                measure(
+                    "preview",
+                    lambda path: image_loader.load_thumbnail(path, FINAL_PREVIEW_SIZE),
+                    paths,
+                    repeat,
+                    stage="decode",
+                    **labels,
+                )
+            )
+            preview_bases = [
+                (image_loader.load_thumbnail(path, FINAL_PREVIEW_SIZE), image_loader.get_image_size(path))
+                for path in paths
+            ]
+            for mode, spec in specs.items():
+                results.append(
+                    measure(
+                        "preview",
+                        lambda base, spec=spec: watermark_engine.render_preview(base[0], base[1], spec),
+                        preview_bases,
+                        repeat,
+                        stage="render",
+                        mode=mode,
+                        **labels,
+                    )
+                )
+
+        if "watermark" in benchmarks:
+            decoded = [watermark_engine.load_image(path) for path in paths]
+            for mode, spec in specs.items():
+                for position in positions:
+                    results.append(
+                        measure(
+                            "watermark",
+                            lambda image, spec=spec.with_changes(position=position): watermark_engine.apply_watermark(
+                                image, spec
+                            ),
+                            decoded,
+                            repeat,
+                            mode=mode,
+                            position=position,
+                            **labels,
+                        )
+                    )
+            del decoded
+
+        if "export" in benchmarks:
+            # The whole per-image export path: decode, watermark, encode and write, once per output profile
+            for profile in OUTPUT_PROFILES.values():
+                results.append(
+                    measure(
+                        "export",
+                        lambda path, profile=profile: _check_export(
+                            export_image(path, None, specs["text"], export_folder, profile)
+                        ),
+                        paths,
+                        repeat,
+                        profile=profile.name,
+                        **labels,
+                    )
+                )
+    return results
+
+
+def _check_export(result):
+    if not result.ok:
+        raise RuntimeError(f"export of {result.image_path} failed: {result.error}")
+
+
+def get_environment():
+    """Describes the machine and code the benchmarks ran on, so saved results can be compared meaningfully."""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "pillow": PIL.__version__,
+        "numpy": numpy.__version__ if numpy else None,
+        # Whether watermarks were blended with the NumPy kernels of the compositing module
+        "numpy_compositing": compositing.USE_NUMPY,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="benchmark", description="Benchmark the import, preview, watermark and export code paths."
+    )
+    parser.add_argument(
+        "--sizes",
+        nargs="+",
+        type=parse_size,
+        default=list(DEFAULT_SIZES),
+        help="image sizes as WIDTHxHEIGHT. Default: 1024x768 4000x3000 6000x4000",
+    )
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=("jpg", "png", "bmp", "gif"),
+        default=list(DEFAULT_FORMATS),
+        help="image formats. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--benchmarks",
+        nargs="+",
+        choices=BENCHMARKS,
+        default=list(BENCHMARKS),
+        help="benchmarks to run. Default: all",
+    )
+    parser.add_argument("--images", type=int, default=IMAGES_PER_SET, help="images per size and format")
+    parser.add_argument("--repeat", type=int, default=1, help="passes over every image set")
+    parser.add_argument("--quick", action="store_true", help="only time the first watermark position")
+    parser.add_argument("--output", help="save the results to this JSON file")
+    parser.add_argument("--keep-images", action="store_true", help="don't delete the generated images")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.images < 1 or args.repeat < 1:
+        parser.error("--images and --repeat must be at least 1")
+
+    work_folder = tempfile.mkdtemp(prefix="watermark-benchmark-")
+    try:
+        print(f"Generating images in {work_folder}", flush=True)
+        image_sets = generate_images(work_folder, args.sizes, args.formats, args.images)
+        results = run_benchmarks(image_sets, work_folder, args.benchmarks, args.repeat, args.quick)
+    finally:
+        if not args.keep_images:
+            shutil.rmtree(work_folder, ignore_errors=True)
+
+    if args.output:
+        report = {
+            "environment": get_environment(),
+            "settings": {
+                "sizes": [f"{width}x{height}" for width, height in args.sizes],
+                "formats": args.formats,
+                "images": args.images,
+                "repeat": args.repeat,
+                "quick": args.quick,
+            },
+            "results": [asdict(result) for result in results],
+        }
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+        print(f"Saved {len(results)} results to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
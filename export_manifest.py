@@ -0,0 +1,190 @@
+"""Manifest of the images exported to an output folder.
+
+The manifest records, for every watermarked image in the folder, the fingerprint of its source and a hash of the
+watermark settings and output profile it was made with. A later export of the same images can then skip every output
+that is still up to date, so re-running a batch after adding a few images, or after a crash, only exports what
+changed.
+
+Entries are keyed by output and source, so images from different folders that share a name never take each other's
+entry, and one replacing the output of another is reported.
+
+The manifest is a JSON lines journal: every finished image appends one line, so an interrupted export keeps
+everything it recorded before it stopped. The journal is compacted to one line per output each time it is opened.
+"""
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+from dataclasses import asdict
+from pathlib import Path
+
+MANIFEST_NAME = ".watermark_manifest.jsonl"
+
+# Bump when the meaning of the recorded fields changes, so older manifests are ignored instead of trusted
+MANIFEST_VERSION = 2
+
+
+def get_fingerprint(path):
+    """Returns (size, mtime_ns) of the file on path, or None if it can't be read."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def get_settings_hash(spec, profile):
+    """Hashes everything besides the source image that decides what an exported image looks like.
+
+    Args:
+        spec (WatermarkSpec): Watermark applied to the images.
+        profile (OutputProfile): Format and encoder settings the images are saved with.
+
+    Returns:
+        str: Hex digest that changes whenever the settings, the watermark image or the font file change.
+    """
+    settings = {
+        "version": MANIFEST_VERSION,
+        "spec": asdict(spec),
+        "profile": asdict(profile),
+        "watermark": get_fingerprint(spec.image_watermark_path) if spec.image_watermark_path else None,
+        "font": get_fingerprint(spec.font) if spec.mode == "text" else None,
+    }
+    return hashlib.sha1(json.dumps(settings, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class ExportManifest:
+    """Tracks which watermarked images in an output folder are up to date. Safe to use from several threads.
+
+    Args:
+        save_location (str): Folder where watermarked images are saved. The manifest file is kept in it.
+        settings_hash (str): Hash of the watermark settings of the current export, from get_settings_hash.
+    """
+
+    def __init__(self, save_location, settings_hash):
+        self.path = Path(save_location) / MANIFEST_NAME
+        self.settings_hash = settings_hash
+        self._lock = threading.Lock()
+        # Fingerprint of each source image checked by is_current, kept until its export is recorded
+        self._pending = {}
+        self.entries = self._load()
+        self._compact()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def is_current(self, image_path, rotate, output_path):
+        """Checks whether output_path is an up to date export of image_path with the current settings.
+
+        Args:
+            image_path (str): Full path of the source image.
+            rotate (int): Rotation the image is exported with.
+            output_path (str): Full path the watermarked image is saved to.
+
+        Returns:
+            bool: True if the export can be skipped.
+        """
+        fingerprint = get_fingerprint(image_path)
+        source = os.path.abspath(image_path)
+        entry = {
+            "source": source,
+            "fingerprint": list(fingerprint) if fingerprint else None,
+            "rotate": rotate,
+            "settings": self.settings_hash,
+        }
+        with self._lock:
+            recorded = self.entries.get((Path(output_path).name, source))
+            self._pending[str(image_path)] = entry
+        if fingerprint is None or not recorded:
+            return False
+        output_fingerprint = get_fingerprint(output_path)
+        return (
+            all(recorded.get(key) == value for key, value in entry.items())
+            and output_fingerprint is not None
+            and recorded.get("output") == list(output_fingerprint)
+        )
+
+    def record(self, image_path, output_path):
+        """Records that image_path was exported to output_path with the current settings. The image must have been
+        checked with is_current first.
+
+        Returns:
+            list: Full paths of the other sources whose export to output_path this one replaced.
+        """
+        output_fingerprint = get_fingerprint(output_path)
+        replaced = []
+        with self._lock:
+            entry = self._pending.pop(str(image_path), None)
+            if entry is None or entry["fingerprint"] is None or output_fingerprint is None:
+                return replaced
+            entry["output"] = list(output_fingerprint)
+            name = Path(output_path).name
+            # Another source exported to the same output before, its entry is out of date now
+            for other_name, other_source in [key for key in self.entries if key[0] == name]:
+                if other_source != entry["source"]:
+                    replaced.append(other_source)
+                    self._write((other_name, other_source), None)
+            self._write((name, entry["source"]), entry)
+        return replaced
+
+    def discard(self, image_path, output_path):
+        """Forgets the export of image_path to output_path, e.g. after it failed and may have left a broken file."""
+        with self._lock:
+            self._pending.pop(str(image_path), None)
+            key = (Path(output_path).name, os.path.abspath(image_path))
+            if key in self.entries:
+                self._write(key, None)
+
+    def close(self):
+        """Closes the manifest file."""
+        with self._lock:
+            self._file.close()
+
+    def _write(self, key, entry):
+        if entry is None:
+            self.entries.pop(key, None)
+        else:
+            self.entries[key] = entry
+        name, source = key
+        self._file.write(json.dumps({"name": name, "source": source, "entry": entry}) + "\n")
+        # Hand every line to the OS right away so it survives a crash of the app
+        self._file.flush()
+
+    def _load(self):
+        entries = {}
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                        entry = record["entry"]
+                        key = (record["name"], record.get("source") or entry["source"])
+                    except (ValueError, KeyError, TypeError):
+                        # The last line may be cut short if the app was killed while writing it
+                        continue
+                    if entry is None:
+                        entries.pop(key, None)
+                    else:
+                        entries[key] = entry
+        except FileNotFoundError:
+            pass
+        except OSError as error:
+            print(f"Could not read export manifest {self.path}: {error}", file=sys.stderr)
+        return entries
+
+    def _compact(self):
+        # Rewrite the journal with one line per output, through a temporary file so a crash never loses it
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # A new manifest is created with the permissions of any other output, for the compacted file to copy them
+        self.path.touch()
+        fd, temp_path = tempfile.mkstemp(dir=self.path.parent, prefix=MANIFEST_NAME, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                for (name, source), entry in self.entries.items():
+                    file.write(json.dumps({"name": name, "source": source, "entry": entry}) + "\n")
+            # mkstemp creates the file readable by its owner only, give it the mode of the manifest it replaces
+            os.chmod(temp_path, os.stat(self.path).st_mode & 0o777)
+            os.replace(temp_path, self.path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
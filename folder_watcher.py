@@ -0,0 +1,441 @@
+"""Watch folders that watermark images as soon as they land in them.
+
+A FolderWatcher feeds the images written to a folder, e.g. a share photographers drop their files in all day, to a
+BatchExporter that keeps running until it is stopped. Changes are picked up with inotify on Linux, called through
+ctypes so no extra package is needed. Elsewhere, or on network mounts where inotify doesn't see the writes made by
+other machines, the folder is scanned every POLL_INTERVAL seconds instead.
+
+A file is only exported once its size and modification time have stayed the same for the settle time, so images that
+are still being copied are never picked up half written. The export manifest of the output folder records every
+exported image, so a restarted watcher skips the images it already exported and only catches up on the ones that
+arrived or changed while it was down.
+"""
+import ctypes
+import ctypes.util
+import json
+import os
+import select
+import struct
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from batch_export import NO_TASK
+from export_manifest import get_fingerprint
+from telemetry import percentile
+
+# Seconds the size and modification time of a file must stay unchanged before it is exported
+SETTLE_TIME = 2.0
+
+# Seconds between two scans of the folder when it is polled instead of watched with inotify
+POLL_INTERVAL = 1.0
+
+# Longest time in seconds the watcher waits for changes before handing control back to the exporter, which collects
+# the finished images in between
+WAIT_TIMEOUT = 0.2
+
+# Seconds of finished images the throughput and latency metrics are computed over
+METRICS_WINDOW = 60.0
+
+# Seconds between two calls of the on_metrics callback of FolderWatcher.run
+METRICS_INTERVAL = 2.0
+
+# inotify flags, from <sys/inotify.h>
+IN_MODIFY = 0x2
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+IN_IGNORED = 0x8000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# Events that may mean a file was added, written to, replaced or removed
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# Header of struct inotify_event: watch descriptor, mask, cookie and length of the name that follows it
+_EVENT = struct.Struct("iIII")
+
+# Size in bytes of the buffer inotify events are read into
+_EVENT_BUFFER_SIZE = 64 * 1024
+
+
+class InotifyWatcher:
+    """Reports the files changed in a folder with the inotify API of Linux.
+
+    Args:
+        folder (str): Folder to watch.
+        recursive (bool, optional): Also watch its sub folders, including the ones created later. Defaults to False.
+        exclude (str, optional): Real path of a folder that is never watched, e.g. the output folder. Defaults to None.
+
+    Raises:
+        OSError: If inotify isn't available, e.g. on another OS, or the folder can't be watched.
+    """
+
+    name = "inotify"
+
+    def __init__(self, folder, recursive=False, exclude=None):
+        if not sys.platform.startswith("linux"):
+            raise OSError("inotify is only available on Linux")
+        self.recursive = recursive
+        self.exclude = exclude
+        self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        # Folder watched by each watch descriptor
+        self._folders = {}
+        try:
+            self._add_watches(folder)
+        except OSError:
+            os.close(self._fd)
+            raise
+
+    def wait(self, timeout):
+        """Waits up to timeout seconds for files to change.
+
+        Returns:
+            set: Paths of the files that changed, empty if none did. None if every file has to be checked again, e.g.
+            after the kernel dropped events because too many arrived at once.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        rescan = False
+        while True:
+            try:
+                data = os.read(self._fd, _EVENT_BUFFER_SIZE)
+            except BlockingIOError:
+                break
+            offset = 0
+            while offset < len(data):
+                descriptor, mask, _, length = _EVENT.unpack_from(data, offset)
+                name = data[offset + _EVENT.size : offset + _EVENT.size + length].rstrip(b"\0")
+                offset += _EVENT.size + length
+                if mask & IN_Q_OVERFLOW:
+                    rescan = True
+                elif mask & IN_IGNORED:
+                    # The folder was removed
+                    self._folders.pop(descriptor, None)
+                elif descriptor in self._folders and name:
+                    path = os.path.join(self._folders[descriptor], os.fsdecode(name))
+                    if not mask & IN_ISDIR:
+                        changed.add(path)
+                    elif self.recursive and mask & (IN_CREATE | IN_MOVED_TO):
+                        # Files may land in a new folder before it is watched, so every file is checked again
+                        try:
+                            self._add_watches(path)
+                        except OSError as error:
+                            print(f"Could not watch {path}: {error}", file=sys.stderr)
+                        rescan = True
+        return None if rescan else changed
+
+    def close(self):
+        """Stops watching the folder."""
+        os.close(self._fd)
+
+    def _add_watches(self, folder):
+        if os.path.realpath(folder) == self.exclude:
+            return
+        descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(folder), WATCH_MASK)
+        if descriptor < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), folder)
+        self._folders[descriptor] = folder
+        if self.recursive:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        self._add_watches(entry.path)
+
+
+class PollingWatcher:
+    """Has the folder scanned every interval seconds. Works on every OS and file system.
+
+    Args:
+        interval (float, optional): Seconds between two scans. Defaults to POLL_INTERVAL.
+    """
+
+    name = "polling"
+
+    def __init__(self, interval=POLL_INTERVAL):
+        self.interval = interval
+        # The folder is scanned once when watching starts
+        self._next_scan = time.monotonic() + interval
+
+    def wait(self, timeout):
+        """Waits up to timeout seconds.
+
+        Returns:
+            set: None when the folder is due for a scan, otherwise an empty set.
+        """
+        delay = self._next_scan - time.monotonic()
+        if delay > timeout:
+            time.sleep(timeout)
+            return set()
+        time.sleep(max(0.0, delay))
+        self._next_scan = time.monotonic() + self.interval
+        return None
+
+    def close(self):
+        """Does nothing, there is nothing to release."""
+
+
+def create_watcher(folder, recursive=False, exclude=None, polling=False):
+    """Returns an InotifyWatcher for folder, or a PollingWatcher if polling is set or inotify isn't available."""
+    if not polling:
+        try:
+            return InotifyWatcher(folder, recursive, exclude)
+        except (OSError, AttributeError) as error:
+            print(f"Could not use inotify ({error}), polling {folder} instead", file=sys.stderr)
+    return PollingWatcher()
+
+
+def write_metrics(metrics, path):
+    """Writes metrics to a JSON file through a temporary file, so monitoring never reads a half written file.
+
+    Args:
+        metrics (dict): Metrics returned by FolderWatcher.get_metrics.
+        path (str): Path of the JSON file.
+    """
+    temp_path = None
+    try:
+        fd, temp_path = tempfile.mkstemp(dir=Path(path).absolute().parent, prefix=Path(path).name, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(metrics, file, indent=4)
+        os.replace(temp_path, path)
+    except OSError as error:
+        print(f"Could not write metrics to {path}: {error}", file=sys.stderr)
+        if temp_path:
+            Path(temp_path).unlink(missing_ok=True)
+
+
+class FolderWatcher:
+    """Exports every image that lands in a folder with a BatchExporter, until it is stopped.
+
+    Args:
+        folder (str): Folder to watch.
+        exporter (BatchExporter): Exports the images. Its save_location is never watched, even inside folder.
+        extensions (set): Lowercase file extensions of the images to export, e.g. {".jpg", ".png"}.
+        rotate (int, optional): Rotation the images are exported with, None uses their EXIF orientation. Defaults to
+            None.
+        recursive (bool, optional): Also export the images in sub folders. Defaults to False.
+        polling (bool, optional): Scan the folder every POLL_INTERVAL seconds instead of using inotify, e.g. for a
+            network share written to by other machines. Defaults to False.
+        settle_time (float, optional): Seconds a file must stay unchanged before it is exported. Defaults to
+            SETTLE_TIME.
+
+    Raises:
+        ValueError: If the output folder of the exporter is the watched folder itself.
+    """
+
+    def __init__(
+        self,
+        folder,
+        exporter,
+        extensions,
+        rotate=None,
+        recursive=False,
+        polling=False,
+        settle_time=SETTLE_TIME,
+    ):
+        self.folder = folder
+        self.exporter = exporter
+        self.extensions = extensions
+        self.rotate = rotate
+        self.recursive = recursive
+        self.polling = polling
+        self.settle_time = settle_time
+        self._exclude = os.path.realpath(exporter.save_location)
+        if os.path.realpath(folder) == self._exclude:
+            raise ValueError("the output folder can't be the watched folder")
+        self.watcher = None
+        # Files waiting to settle: path -> (fingerprint, monotonic time the file was last seen changing)
+        self._settling = {}
+        # Settled files waiting for the exporter, in the order they settled: path -> time they last changed
+        self._ready = {}
+        # Fingerprint of every file handed to the exporter, so it is only exported again once it changes
+        self._handed_over = {}
+        self._scan_failed = False
+        # The rest is shared with the thread the exporter reports finished images on
+        self._lock = threading.Lock()
+        # Images being exported: path -> time they last changed
+        self._in_flight = {}
+        # (monotonic time, latency in seconds from the last change to the output) of the recently exported images
+        self._finished = deque()
+        self._start = time.monotonic()
+        self._next_metrics = 0.0
+        self.exported = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def run(self, on_progress=None, on_metrics=None):
+        """Watches the folder and exports its images until stop() is called. Images already in the folder are exported
+        first, unless the export manifest shows their outputs are up to date.
+
+        Args:
+            on_progress (callable, optional): Called with (completed_count, ExportResult) every time an image
+                finishes, like the on_progress of BatchExporter.run.
+            on_metrics (callable, optional): Called with the dict of get_metrics every METRICS_INTERVAL seconds while
+                images are coming in or being exported, and once more when the watcher stops.
+
+        Returns:
+            list: ExportResult of every image that failed to export.
+        """
+        self._start = time.monotonic()
+        self.watcher = create_watcher(self.folder, self.recursive, self._exclude, self.polling)
+        try:
+            return self.exporter.run(
+                self._iter_tasks(on_metrics), lambda count, result: self._finish(count, result, on_progress)
+            )
+        finally:
+            self.watcher.close()
+            if on_metrics:
+                on_metrics(self.get_metrics())
+
+    def stop(self):
+        """Stops watching. Images being exported are finished first, the others are exported on the next run. Safe to
+        call from any thread and from signal handlers."""
+        self.exporter.cancel()
+
+    def get_metrics(self):
+        """Returns the current state of the watcher.
+
+        Returns:
+            dict: "queue_depth" is the number of images waiting to settle, to be exported or being exported, and
+            "images_per_second" and "latency_p95_s" cover the images exported over the last METRICS_WINDOW seconds.
+            The latency runs from the last change of a file to its output being saved.
+        """
+        now = time.monotonic()
+        waiting = len(self._settling) + len(self._ready)
+        with self._lock:
+            while self._finished and now - self._finished[0][0] > METRICS_WINDOW:
+                self._finished.popleft()
+            latencies = [latency for _, latency in self._finished]
+            in_flight = len(self._in_flight)
+            counts = {"exported": self.exported, "skipped": self.skipped, "failed": self.failed}
+        window = min(METRICS_WINDOW, now - self._start)
+        return {
+            "folder": self.folder,
+            "watcher": self.watcher.name if self.watcher else None,
+            "queue_depth": waiting + in_flight,
+            "in_flight": in_flight,
+            **counts,
+            "images_per_second": round(len(latencies) / window, 3) if window > 0 else 0.0,
+            "latency_p95_s": round(percentile(latencies, 95), 3) if latencies else None,
+            "uptime_s": round(now - self._start, 1),
+            "time": time.time(),
+        }
+
+    def _iter_tasks(self, on_metrics):
+        # Runs on the thread the exporter reads its tasks on, which owns the settling and ready files
+        changes = None
+        while not self.exporter.cancelled:
+            now = time.monotonic()
+            if changes is None:
+                self._scan(now)
+            for path in changes or ():
+                self._observe(path, now)
+            self._settle(now)
+            self._publish(on_metrics)
+            while self._ready and not self.exporter.cancelled:
+                path = next(iter(self._ready))
+                with self._lock:
+                    self._in_flight[path] = self._ready.pop(path)
+                yield path, self.rotate
+                self._publish(on_metrics)
+            yield NO_TASK
+            changes = self.watcher.wait(WAIT_TIMEOUT)
+
+    def _publish(self, on_metrics):
+        if on_metrics and time.monotonic() >= self._next_metrics:
+            self._next_metrics = time.monotonic() + METRICS_INTERVAL
+            on_metrics(self.get_metrics())
+
+    def _finish(self, count, result, on_progress):
+        now = time.monotonic()
+        with self._lock:
+            changed = self._in_flight.pop(result.image_path, None)
+            if result.skipped:
+                self.skipped += 1
+            elif not result.ok:
+                self.failed += 1
+            else:
+                self.exported += 1
+                if changed is not None:
+                    self._finished.append((now, now - changed))
+        if on_progress:
+            on_progress(count, result)
+
+    def _is_image(self, path):
+        # Hidden files are skipped, they are usually temporary files of copy tools, e.g. rsync
+        name = os.path.basename(path)
+        return not name.startswith(".") and Path(name).suffix.lower() in self.extensions
+
+    def _observe(self, path, now):
+        if not self._is_image(path):
+            return
+        fingerprint = get_fingerprint(path)
+        if fingerprint is None:
+            # Deleted or moved away
+            self._settling.pop(path, None)
+            self._ready.pop(path, None)
+            self._handed_over.pop(path, None)
+            return
+        settling = self._settling.get(path)
+        if settling is None and fingerprint == self._handed_over.get(path):
+            return
+        if settling is None or settling[0] != fingerprint:
+            # A file that changes again waits for the full settle time, even if it was already about to be exported
+            self._ready.pop(path, None)
+            self._settling[path] = (fingerprint, now)
+
+    def _settle(self, now):
+        with self._lock:
+            in_flight = set(self._in_flight)
+        for path, (fingerprint, changed) in list(self._settling.items()):
+            # A file that changed while it was being exported is exported again once that export is done
+            if now - changed < self.settle_time or path in in_flight:
+                continue
+            if get_fingerprint(path) != fingerprint:
+                self._observe(path, now)
+                continue
+            del self._settling[path]
+            self._handed_over[path] = fingerprint
+            self._ready[path] = changed
+
+    def _scan(self, now):
+        found = set()
+        self._scan_failed = False
+        for path in self._iter_files(self.folder):
+            found.add(path)
+            self._observe(path, now)
+        if self._scan_failed:
+            return
+        # Forget the files that are gone, scanning is the only way to notice when polling
+        for files in (self._settling, self._ready, self._handed_over):
+            for path in [path for path in files if path not in found]:
+                del files[path]
+
+    def _iter_files(self, folder):
+        try:
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        if self.recursive and os.path.realpath(entry.path) != self._exclude:
+                            yield from self._iter_files(entry.path)
+                    elif self._is_image(entry.path):
+                        yield entry.path
+        except OSError as error:
+            # The folder may be a share that is briefly unavailable, it is scanned again on the next change or poll
+            print(f"Could not scan {folder}: {error}", file=sys.stderr)
+            self._scan_failed = True
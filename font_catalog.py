@@ -0,0 +1,69 @@
+"""Catalog of the fonts bundled in the fonts folder.
+
+Listing the catalog only reads the folder, font files are opened the first time their metadata is asked for.
+"""
+import os
+from pathlib import Path
+
+from PIL import ImageFont
+
+FONTS_FOLDER = Path(__file__).resolve().parent / "fonts"
+FONT_EXTENSIONS = {".ttf", ".otf"}
+
+
+class FontCatalog:
+    """Lists the fonts available in a folder by name and lazily reads their metadata.
+
+    Args:
+        folder (str, optional): Folder containing the font files. Defaults to the bundled fonts folder.
+    """
+
+    def __init__(self, folder=FONTS_FOLDER):
+        self.folder = Path(folder)
+        self._paths = None
+        self._metadata = {}
+
+    @property
+    def names(self):
+        """list: Sorted font names, i.e. the font file names without extension, as shown in the font option menu."""
+        return sorted(self._get_paths(), key=str.lower)
+
+    def path(self, name):
+        """Returns the path of the font file for the passed font name.
+
+        Args:
+            name (str): Font name as returned by names.
+
+        Returns:
+            str: Full path of the font file.
+        """
+        try:
+            return self._get_paths()[name]
+        except KeyError:
+            raise KeyError(f"Unknown font: {name}") from None
+
+    def metadata(self, name):
+        """Returns the family, style and file size of the passed font. The font file is only parsed the first time
+        this is called for it.
+
+        Args:
+            name (str): Font name as returned by names.
+
+        Returns:
+            dict: {"family": str, "style": str, "file_size": int}
+        """
+        if name not in self._metadata:
+            path = self.path(name)
+            family, style = ImageFont.truetype(path, size=10).getname()
+            self._metadata[name] = {"family": family, "style": style, "file_size": os.path.getsize(path)}
+        return self._metadata[name]
+
+    def _get_paths(self):
+        if self._paths is None:
+            self._paths = {}
+            with os.scandir(self.folder) as entries:
+                for entry in entries:
+                    font = Path(entry.name)
+                    if entry.is_file() and font.suffix.lower() in FONT_EXTENSIONS:
+                        self._paths[font.stem] = entry.path
+        return self._paths
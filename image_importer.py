@@ -0,0 +1,117 @@
+"""Parallel, streaming import of images.
+
+Thumbnails are decoded on a pool of worker threads and handed back through a queue as soon as each one is ready, so
+the Tk thread can show them progressively instead of waiting for the whole selection. PIL releases the GIL while
+decoding, so threads are enough to keep several cores busy.
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+
+@dataclass
+class ImportResult:
+    """Outcome of importing a single image.
+
+    Attributes:
+        path (str): Full path of the image.
+        thumbnail (PIL Image): Decoded and rotated thumbnail of the image, None if the import failed.
+        rotate (int): Counter-clockwise rotation in degrees that makes the image upright.
+        error (str): Description of the error that stopped the import, None if it succeeded.
+    """
+
+    path: str
+    thumbnail: object = None
+    rotate: int = 0
+    error: str = None
+
+    @property
+    def ok(self):
+        """bool: True if the image was imported successfully."""
+        return self.error is None
+
+
+class ImageImporter:
+    """Decodes thumbnails for a list of images on a thread pool.
+
+    Args:
+        load_thumbnail (callable): Called with an image path and rotation on a worker thread, returns its thumbnail.
+        get_rotation (callable, optional): Called with an image path on a worker thread, returns the rotation the
+            image starts with, e.g. from its EXIF orientation. Images start unrotated if not set.
+        workers (int, optional): Number of worker threads. Defaults to the number of CPUs, up to 8.
+    """
+
+    def __init__(self, load_thumbnail, get_rotation=None, workers=None):
+        self.load_thumbnail = load_thumbnail
+        self.get_rotation = get_rotation
+        self.workers = max(1, workers or min(8, os.cpu_count() or 1))
+        self.results = queue.Queue()
+        self.total = 0
+        self.completed = 0
+        self.start_time = None
+        self._cancel_event = threading.Event()
+        self._executor = None
+
+    @property
+    def cancelled(self):
+        """bool: True once cancel() has been called."""
+        return self._cancel_event.is_set()
+
+    @property
+    def done(self):
+        """bool: True once every image was handed back through get_results, or the import was cancelled."""
+        return self.cancelled or self.completed >= self.total
+
+    @property
+    def images_per_second(self):
+        """float: Number of images imported per second so far."""
+        elapsed = time.perf_counter() - self.start_time if self.start_time else 0
+        return self.completed / elapsed if elapsed > 0 else 0.0
+
+    def start(self, paths):
+        """Starts decoding the thumbnails of paths in the background and returns right away.
+
+        Args:
+            paths (list): Full paths of the images to import.
+        """
+        self.total = len(paths)
+        self.start_time = time.perf_counter()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="ImageImporter")
+        for path in paths:
+            self._executor.submit(self._import, path)
+        self._executor.shutdown(wait=False)
+
+    def cancel(self):
+        """Stops the import. Images that were not started yet are skipped. Safe to call from any thread."""
+        self._cancel_event.set()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def get_results(self, max_count=50):
+        """Returns the results that are ready without blocking, at most max_count of them so the Tk thread never
+        spends too long handling a single batch.
+
+        Returns:
+            list: ImportResult of the images that finished since the last call.
+        """
+        results = []
+        while len(results) < max_count and not self.cancelled:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                break
+        self.completed += len(results)
+        return results
+
+    def _import(self, path):
+        if self.cancelled:
+            return
+        try:
+            rotate = self.get_rotation(path) if self.get_rotation else 0
+            result = ImportResult(path=path, thumbnail=self.load_thumbnail(path, rotate), rotate=rotate)
+        except Exception as error:
+            result = ImportResult(path=path, error=f"{type(error).__name__}: {error}")
+        self.results.put(result)
@@ -0,0 +1,132 @@
+"""Reduced resolution decoding for previews and thumbnails.
+
+Previews and thumbnails are much smaller than camera originals, so decoding every pixel of the original only to throw
+most of them away is wasted work. JPEGs are decoded with DCT scaling (PIL's draft mode) and the thumbnail embedded in
+the EXIF data is used instead when it is big enough.
+"""
+from io import BytesIO
+
+from PIL import ExifTags, Image
+
+import watermark_engine
+
+# EXIF tags holding the offset and length of the embedded JPEG thumbnail in IFD1
+EXIF_THUMBNAIL_OFFSET = 0x0201
+EXIF_THUMBNAIL_LENGTH = 0x0202
+
+# Maximum difference between the aspect ratio of the embedded thumbnail and the original image. Some cameras store
+# letterboxed thumbnails which must not be used.
+ASPECT_RATIO_TOLERANCE = 0.02
+
+
+def get_fit_size(image_size, size):
+    """Returns the size image_size would have after Image.thumbnail(size), keeping the aspect ratio."""
+    scale = min(size[0] / image_size[0], size[1] / image_size[1], 1)
+    return max(1, round(image_size[0] * scale)), max(1, round(image_size[1] * scale))
+
+
+def _get_exif_thumbnail(image, size):
+    """Returns the thumbnail embedded in the EXIF data of image if it is at least as big as image would be once
+    fitted into size and has the same aspect ratio, otherwise None."""
+    exif_data = image.info.get("exif")
+    if not exif_data:
+        return None
+    try:
+        ifd1 = image.getexif().get_ifd(ExifTags.IFD.IFD1)
+        offset, length = ifd1[EXIF_THUMBNAIL_OFFSET], ifd1[EXIF_THUMBNAIL_LENGTH]
+        # Offsets are relative to the TIFF header which follows the "Exif\0\0" marker
+        if exif_data.startswith(b"Exif\x00\x00"):
+            offset += 6
+        thumbnail = Image.open(BytesIO(exif_data[offset : offset + length]))
+        thumbnail.load()
+    except Exception:
+        return None
+
+    fit_width, fit_height = get_fit_size(image.size, size)
+    aspect_ratio_difference = abs(thumbnail.width / thumbnail.height - image.width / image.height)
+    if (
+        thumbnail.width < fit_width
+        or thumbnail.height < fit_height
+        or aspect_ratio_difference > ASPECT_RATIO_TOLERANCE * image.width / image.height
+    ):
+        return None
+    return thumbnail
+
+
+def open_reduced(image_path, size):
+    """Opens and decodes the image on the passed path at the smallest resolution that is still at least as big as
+    the image would be once fitted into size.
+
+    Args:
+        image_path (str): Full path of the image to open.
+        size (tuple): (width, height) the image is going to be shrunk to.
+
+    Returns:
+        PIL Image: The decoded image. It can be bigger than size, but never smaller than the fitted size.
+    """
+    with Image.open(image_path) as image:
+        if image.format == "JPEG":
+            thumbnail = _get_exif_thumbnail(image, size)
+            if thumbnail is not None:
+                return thumbnail
+            # Let the JPEG decoder skip detail that is thrown away anyway, keeping the colour mode as is
+            image.draft(image.mode, get_fit_size(image.size, size))
+        image.load()
+        return image
+
+
+def get_exif_rotation(image_path):
+    """Returns the counter-clockwise rotation that makes the image on the passed path upright according to its EXIF
+    orientation, only reading the file header.
+
+    Args:
+        image_path (str): Full path of the image.
+
+    Returns:
+        int: 0, 90, 180 or 270.
+    """
+    with Image.open(image_path) as image:
+        return watermark_engine.get_exif_rotation(image)
+
+
+def get_image_size(image_path, rotate=0):
+    """Returns the (width, height) of the image on the passed path once rotated, only reading the file header.
+
+    Args:
+        image_path (str): Full path of the image.
+        rotate (int, optional): Counter-clockwise rotation in degrees. Defaults to 0.
+
+    Returns:
+        tuple: (width, height) of the rotated image.
+    """
+    with Image.open(image_path) as image:
+        width, height = image.size
+    if rotate in (90, 270):
+        return height, width
+    return width, height
+
+
+def load_thumbnail(image_path, size, rotate=0, cache=None):
+    """Returns a copy of the image on the passed path shrunk to fit into size and rotated by rotate degrees.
+
+    Args:
+        image_path (str): Full path of the image.
+        size (tuple): Maximum (width, height) of the returned image.
+        rotate (int, optional): Counter-clockwise rotation in degrees. Defaults to 0.
+        cache (ThumbnailCache, optional): Persistent cache to read the thumbnail from and store it in. Thumbnails are
+            cached before rotation, so rotating an image never needs the source file again.
+
+    Returns:
+        PIL Image: The shrunk and rotated image.
+    """
+    image = cache.get(image_path, size) if cache else None
+    if image is None:
+        image = open_reduced(image_path, size)
+        image.thumbnail(size)
+        if cache:
+            try:
+                cache.put(image_path, size, image)
+            except OSError:
+                # The cache only saves time, a thumbnail that can't be stored is decoded again next time
+                pass
+    return watermark_engine.rotate_image(image, rotate)
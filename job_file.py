@@ -0,0 +1,245 @@
+"""Job files describing a complete batch export.
+
+A job holds the watermark settings, the output folder and profile, and the list of images with the rotation chosen for
+each of them, so a batch can be saved from the app and run again later, in the app or headless with
+`python -m watermarker --job job.toml`. Jobs are written as JSON and can be read from JSON or TOML, e.g.:
+
+    version = 1
+
+    [watermark]
+    mode = "text"
+    text = "(c) Studio"
+    position = "bottom-right"
+    opacity = 60
+
+    [output]
+    folder = "watermarked"
+    profile = "fast-jpeg"
+
+    [[images]]
+    path = "shoot/0001.jpg"
+    rotate = 90
+
+Relative paths are resolved from the folder of the job file. An image without a rotate value uses its EXIF
+orientation, and watermark settings that are left out use the WatermarkSpec defaults.
+"""
+import json
+import os
+from dataclasses import asdict, dataclass, field, fields
+from pathlib import Path
+
+from font_catalog import FONTS_FOLDER, FontCatalog
+from output_profiles import DEFAULT_PROFILE, OUTPUT_PROFILES
+from watermark_engine import POSITIONS, TRANSPOSE_ROTATIONS, WatermarkSpec
+
+try:
+    import tomllib
+except ImportError:
+    tomllib = None
+
+JOB_VERSION = 1
+
+# Errors raised while parsing a job file that isn't valid JSON or TOML
+DECODE_ERRORS = (ValueError, UnicodeDecodeError) + ((tomllib.TOMLDecodeError,) if tomllib else ())
+
+# Type of the single value watermark settings, checked on load so a wrong type isn't only found by the engine
+SPEC_TYPES = {
+    "mode": str,
+    "image_watermark_path": str,
+    "text": str,
+    "position": str,
+    "text_watermark_size": int,
+    "margin": int,
+    "font": str,
+    "opacity": int,
+    "tile_spacing": int,
+    "tile_angle": int,
+}
+
+# Number of values of the watermark settings stored as lists of numbers
+SPEC_LENGTHS = {"image_watermark_size": 2, "text_color": 3}
+
+
+@dataclass
+class Job:
+    """A batch export that can be saved to and loaded from a job file.
+
+    Attributes:
+        spec (WatermarkSpec): Watermark applied to every image.
+        images (list): (image_path, rotate) tuples. A rotate of None uses the EXIF orientation of the image.
+        save_location (str): Folder where watermarked images are saved.
+        profile (str): Name of the output profile the images are saved with.
+        workers (int): Number of export workers, None for one per CPU.
+    """
+
+    spec: WatermarkSpec = field(default_factory=WatermarkSpec)
+    images: list = field(default_factory=list)
+    save_location: str = "output"
+    profile: str = DEFAULT_PROFILE.name
+    workers: int = None
+
+
+def load_job(path):
+    """Reads a job file, in JSON or in TOML if its extension is .toml.
+
+    Args:
+        path (str): Path of the job file.
+
+    Raises:
+        ValueError: If the file can't be parsed or describes an invalid job.
+
+    Returns:
+        Job: The job described by the file, with every path resolved.
+    """
+    path = Path(path)
+    is_toml = path.suffix.lower() == ".toml"
+    if is_toml and tomllib is None:
+        raise ValueError("reading TOML job files needs Python 3.11 or newer, use JSON instead")
+    try:
+        if is_toml:
+            with open(path, "rb") as file:
+                data = tomllib.load(file)
+        else:
+            with open(path, encoding="utf-8") as file:
+                data = json.load(file)
+    except DECODE_ERRORS as error:
+        raise ValueError(f"{path.name} is not a valid job file: {error}") from None
+    return parse_job(data, base_folder=path.parent)
+
+
+def save_job(job, path):
+    """Writes a job file in JSON. Paths are stored as absolute paths so the job can be run from any folder, except
+    fonts bundled with the app that are stored by name so the file also works on other machines.
+
+    Args:
+        job (Job): The job to save.
+        path (str): Path of the job file.
+    """
+    watermark = asdict(job.spec)
+    if job.spec.image_watermark_path:
+        watermark["image_watermark_path"] = os.path.abspath(job.spec.image_watermark_path)
+    font = Path(job.spec.font)
+    watermark["font"] = font.stem if font.parent.resolve() == FONTS_FOLDER.resolve() else os.path.abspath(font)
+    output = {"folder": os.path.abspath(job.save_location), "profile": job.profile}
+    if job.workers:
+        output["workers"] = job.workers
+    data = {
+        "version": JOB_VERSION,
+        # Settings without a value are left out, like they have to be in TOML
+        "watermark": {key: value for key, value in watermark.items() if value is not None},
+        "output": output,
+        "images": [
+            {"path": os.path.abspath(image_path)}
+            if rotate is None
+            else {"path": os.path.abspath(image_path), "rotate": rotate}
+            for image_path, rotate in job.images
+        ],
+    }
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=2)
+        file.write("\n")
+
+
+def parse_job(data, base_folder="."):
+    """Builds a Job from the content of a job file.
+
+    Args:
+        data (dict): Parsed content of the job file.
+        base_folder (str, optional): Folder relative paths are resolved from. Defaults to the working folder.
+
+    Raises:
+        ValueError: If data describes an invalid job.
+
+    Returns:
+        Job: The described job.
+    """
+    base_folder = Path(base_folder)
+    if not isinstance(data, dict):
+        raise ValueError("a job file must hold a table of settings")
+    version = data.get("version", JOB_VERSION)
+    if version != JOB_VERSION:
+        raise ValueError(f"unsupported job file version {version!r}, expected {JOB_VERSION}")
+    _check_keys(data, {"version", "watermark", "output", "images"}, "job")
+
+    output = data.get("output", {})
+    _check_keys(output, {"folder", "profile", "workers"}, "output")
+    profile = output.get("profile", DEFAULT_PROFILE.name)
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError(f"unknown output profile {profile!r}, expected one of {', '.join(OUTPUT_PROFILES)}")
+    workers = output.get("workers")
+    if workers is not None and (not isinstance(workers, int) or workers < 1):
+        raise ValueError(f"output workers must be a positive number, got {workers!r}")
+
+    return Job(
+        spec=_parse_spec(data.get("watermark", {}), base_folder),
+        images=[_parse_image(image, base_folder) for image in data.get("images", [])],
+        save_location=str(base_folder / output.get("folder", "output")),
+        profile=profile,
+        workers=workers,
+    )
+
+
+def _parse_spec(settings, base_folder):
+    _check_keys(settings, {spec_field.name for spec_field in fields(WatermarkSpec)}, "watermark")
+    for key, expected in SPEC_TYPES.items():
+        value = settings.get(key)
+        if value is not None and not _is_type(value, expected):
+            raise ValueError(f"watermark {key} must be a {'number' if expected is int else 'string'}, got {value!r}")
+    for key, length in SPEC_LENGTHS.items():
+        value = settings.get(key)
+        if value is not None and not (
+            isinstance(value, (list, tuple)) and len(value) == length and all(_is_type(item, int) for item in value)
+        ):
+            raise ValueError(f"watermark {key} must be a list of {length} numbers, got {value!r}")
+
+    # Default to the bundled font rather than a path relative to the working folder
+    settings = {"font": "Roboto-Regular", **settings}
+    if settings.get("image_watermark_path"):
+        settings["image_watermark_path"] = str(base_folder / settings["image_watermark_path"])
+
+    # Fonts are given by name, like in the font option menu, or as a path to a .ttf file
+    font = settings["font"]
+    if Path(font).suffix.lower() == ".ttf":
+        settings["font"] = str(base_folder / font)
+    else:
+        try:
+            settings["font"] = FontCatalog().path(font)
+        except KeyError:
+            raise ValueError(f"unknown font {font!r}") from None
+
+    # Sizes and colors are lists in JSON and TOML
+    for key in ("image_watermark_size", "text_color"):
+        if key in settings:
+            settings[key] = tuple(settings[key])
+    spec = WatermarkSpec(**settings)
+
+    if spec.mode not in ("image", "text"):
+        raise ValueError(f"unknown watermark mode {spec.mode!r}, expected image or text")
+    if spec.position not in POSITIONS:
+        raise ValueError(f"unknown watermark position {spec.position!r}, expected one of {', '.join(POSITIONS)}")
+    return spec
+
+
+def _parse_image(image, base_folder):
+    if isinstance(image, str):
+        image = {"path": image}
+    if not isinstance(image, dict) or "path" not in image:
+        raise ValueError(f"every image needs a path, got {image!r}")
+    _check_keys(image, {"path", "rotate"}, "image")
+    rotate = image.get("rotate")
+    if rotate is not None and rotate not in (0, *TRANSPOSE_ROTATIONS):
+        raise ValueError(f"rotate of {image['path']} must be 0, 90, 180 or 270, got {rotate!r}")
+    return str(base_folder / image["path"]), rotate
+
+
+def _is_type(value, expected):
+    # JSON and TOML booleans are ints to Python, but never a valid number setting
+    return isinstance(value, expected) and not isinstance(value, bool)
+
+
+def _check_keys(table, allowed, name):
+    if not isinstance(table, dict):
+        raise ValueError(f"{name} settings must be a table")
+    unknown = set(table) - allowed
+    if unknown:
+        raise ValueError(f"unknown {name} setting(s): {', '.join(sorted(unknown))}")
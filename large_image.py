@@ -0,0 +1,185 @@
+"""Watermarking of images too large to decode comfortably, like scanned panoramas and print masters.
+
+Large image mode lifts the decompression bomb guard of PIL, which otherwise refuses images over about 180 megapixels.
+Images whose pixels are stored uncompressed (uncompressed TIFF, BMP and binary PPM) and are saved in their own format
+are then watermarked without decoding them: the source file is copied to the output and only the rows under the
+watermark are read, watermarked and written back, a band at a time. Peak memory is bounded by PATCH_MEMORY whatever
+the size of the image, and reading the file strip by strip never touches the pixels outside the watermark.
+
+Compressed images can't be decoded or encoded in parts by PIL, so they are decoded once and watermarked in place by
+the regular export, which needs about the memory of the decoded image but no full size copies of it.
+"""
+import shutil
+import threading
+from contextlib import contextmanager
+
+from PIL import Image
+
+import telemetry
+from output_profiles import open_output
+from watermark_engine import EXIF_ORIENTATION, composite_watermark, get_watermark_box
+
+# Maximum number of pixels in the band of rows watermarked at a time. Blending needs a few dozen bytes of temporary
+# arrays per pixel, so a band never takes more than about 50 MB.
+BAND_PIXELS = 1024 * 1024
+
+# Estimated peak memory in bytes of patching an image, used for the memory budget of a batch
+PATCH_MEMORY = BAND_PIXELS * 48
+
+# Size in bytes of the chunks the source file is copied to the output in
+COPY_CHUNK_SIZE = 4 * 1024 * 1024
+
+# Image modes that can be patched and the raw layouts their pixels may be stored in
+PATCH_RAWMODES = {
+    "RGB": ("RGB", "BGR", "RGBX", "BGRX"),
+    "RGBA": ("RGBA", "BGRA"),
+}
+
+# MAX_IMAGE_PIXELS is global to PIL, so it is lifted once for all threads that are in large image mode
+_guard_lock = threading.Lock()
+_guard_users = 0
+_guard_limit = None
+
+
+@contextmanager
+def allow_large_images():
+    """Lifts the decompression bomb guard of PIL for the code it wraps, on every thread. Safe to nest and to use from
+    several threads at once, the guard is restored when the last of them is done."""
+    global _guard_users, _guard_limit
+    with _guard_lock:
+        if _guard_users == 0:
+            _guard_limit = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = None
+        _guard_users += 1
+    try:
+        yield
+    finally:
+        with _guard_lock:
+            _guard_users -= 1
+            if _guard_users == 0:
+                Image.MAX_IMAGE_PIXELS = _guard_limit
+
+
+def get_raw_tiles(image):
+    """Returns the layout of the pixels of an opened image in its file if they are stored uncompressed.
+
+    Args:
+        image (PIL Image): Opened image that hasn't been loaded yet.
+
+    Returns:
+        list: (extents box, offset of the first row, rawmode, bytes per pixel, stride, orientation) tuple for every
+        tile of the file, or None if the image can't be patched.
+    """
+    if image.mode not in PATCH_RAWMODES or getattr(image, "n_frames", 1) > 1:
+        return None
+    tiles = []
+    for tile in image.tile:
+        args = (tile.args,) if isinstance(tile.args, str) else tuple(tile.args)
+        rawmode, stride, orientation = (args + (0, 1))[:3]
+        if tile.codec_name != "raw" or rawmode not in PATCH_RAWMODES[image.mode]:
+            return None
+        pixel_size = len(rawmode)
+        x0, y0, x1, y1 = tile.extents
+        tiles.append((tile.extents, tile.offset, rawmode, pixel_size, stride or (x1 - x0) * pixel_size, orientation))
+    return tiles or None
+
+
+def can_patch(image_path, rotate, profile):
+    """Checks whether an image can be watermarked by patching a copy of its file.
+
+    Args:
+        image_path (str): Full path of the source image.
+        rotate (int): Counter-clockwise rotation in degrees stored for the image. None uses its EXIF orientation.
+        profile (OutputProfile): Profile the image is saved with.
+
+    Returns:
+        bool: True if the image is stored uncompressed, is exported upright and the profile saves it in its own format
+        with default settings, so the output only differs from the source by the watermarked pixels.
+    """
+    try:
+        with Image.open(image_path) as image:
+            orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+            return (
+                get_raw_tiles(image) is not None
+                and not rotate
+                and orientation == 1
+                and profile.get_format(image_path) == image.format
+                and not profile.save_options
+                and profile.get_mode(image, image_path) == image.mode
+            )
+    except Exception:
+        return False
+
+
+def patch_watermark(image_path, spec, output_path, timer=None):
+    """Watermarks an image checked with can_patch by copying its file to output_path and rewriting the pixels under
+    the watermark, a band of rows at a time.
+
+    Args:
+        image_path (str): Full path of the image to export.
+        spec (WatermarkSpec): Description of the watermark to apply.
+        output_path (str): Full path the watermarked image is saved to.
+        timer (StageTimer, optional): Records the stage times of the export when telemetry is on. Defaults to None.
+    """
+    with Image.open(image_path) as image:
+        tiles = get_raw_tiles(image)
+        mode, size = image.mode, image.size
+        if timer is not None:
+            timer.details.update(format=image.format, mode=mode, width=image.width, height=image.height)
+    box = get_watermark_box(size, spec)
+
+    with open(image_path, "rb") as source, open_output(output_path) as output:
+        with telemetry.stage(timer, "encode"):
+            shutil.copyfileobj(source, output, COPY_CHUNK_SIZE)
+        if box is None:
+            return
+        left, top, right, bottom = box
+        band_height = max(1, BAND_PIXELS // (right - left))
+        for band_top in range(top, bottom, band_height):
+            band_box = (left, band_top, right, min(bottom, band_top + band_height))
+            with telemetry.stage(timer, "decode"):
+                band = _read_region(source, tiles, mode, band_box)
+            with telemetry.stage(timer, "composite"):
+                composite_watermark(band, spec, offset=band_box[:2], image_size=size)
+            with telemetry.stage(timer, "encode"):
+                _write_region(output, tiles, band, band_box)
+
+
+def _get_overlaps(tiles, box):
+    # Yields every tile that overlaps box with the part of box it holds
+    for tile in tiles:
+        x0, y0, x1, y1 = tile[0]
+        overlap = (max(x0, box[0]), max(y0, box[1]), min(x1, box[2]), min(y1, box[3]))
+        if overlap[0] < overlap[2] and overlap[1] < overlap[3]:
+            yield tile, overlap
+
+
+def _get_row_offset(tile, x, y):
+    (x0, y0, x1, y1), offset, _, pixel_size, stride, orientation = tile
+    # Bottom-up files, like most BMPs, store the last row of the tile first
+    row = y - y0 if orientation >= 0 else y1 - 1 - y
+    return offset + row * stride + (x - x0) * pixel_size
+
+
+def _read_region(file, tiles, mode, box):
+    region = Image.new(mode, (box[2] - box[0], box[3] - box[1]))
+    for tile, (left, top, right, bottom) in _get_overlaps(tiles, box):
+        rawmode, pixel_size = tile[2], tile[3]
+        rows = []
+        for y in range(top, bottom):
+            file.seek(_get_row_offset(tile, left, y))
+            rows.append(file.read((right - left) * pixel_size))
+        part = Image.frombytes(mode, (right - left, bottom - top), b"".join(rows), "raw", rawmode)
+        region.paste(part, (left - box[0], top - box[1]))
+    return region
+
+
+def _write_region(file, tiles, region, box):
+    for tile, (left, top, right, bottom) in _get_overlaps(tiles, box):
+        rawmode, pixel_size = tile[2], tile[3]
+        part = region.crop((left - box[0], top - box[1], right - box[0], bottom - box[1]))
+        data = part.tobytes("raw", rawmode)
+        row_size = (right - left) * pixel_size
+        for index, y in enumerate(range(top, bottom)):
+            file.seek(_get_row_offset(tile, left, y))
+            file.write(data[index * row_size : (index + 1) * row_size])
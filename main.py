@@ -1,13 +1,23 @@
+import queue
 import threading
 from pathlib import Path
-from tkinter import Button, colorchooser
-from tkinter.filedialog import askdirectory, askopenfilename, askopenfilenames
+from tkinter import colorchooser, messagebox
+from tkinter.filedialog import askdirectory, askopenfilename, askopenfilenames, asksaveasfilename
 
 import customtkinter
-from PIL import Image, ImageDraw, ImageFont, ImageTk
-
+import image_loader
+import job_file
+import watermark_engine
+from batch_export import BatchExporter
 from ControlsFrame import ControlsFrame
 from DoubleScrolledFrame import DoubleScrolledFrame
+from font_catalog import FONTS_FOLDER
+from image_importer import ImageImporter
+from output_profiles import OUTPUT_PROFILES
+from preview_scheduler import PreviewScheduler
+from thumbnail_cache import ThumbnailCache
+from ThumbnailStrip import ThumbnailStrip
+from watermark_engine import WatermarkSpec
 
 # Set image thumbnail size for watermark preview and image list preview frames
 THUMBNAIL_SIZE = (125, 125)
@@ -20,17 +30,26 @@ class App(customtkinter.CTk):
     def __init__(self):
         super().__init__()
 
-        self.geometry("1170x750")
+        self.geometry("1190x750")
         self.title("Mass Watermarker")
         self.resizable(width=False, height=False)
 
         # Store image path and associated attributes using the format below
-        # {"path": {"rotate": 0, "transparency": 0, "imagetk": None}
+        # {"path": {"rotate": 0, "transparency": 0}}
         self.image_dictionary = {}
 
         # Stores path of image currently shown in the watermark preview frame
         self.current_image_path = None
 
+        # Thumbnails are cached on disk so images that were already imported once load almost instantly
+        self.thumbnail_cache = ThumbnailCache()
+
+        # Stores the ImageImporter of the last import started with the Add Image(s) button
+        self.image_importer = None
+
+        # Stores ((path, rotate), preview sized image, original size) of the image shown in the watermark preview frame
+        self.preview_base = None
+
         # Store path of image or text chosen as watermark
         self.current_image_watermark_path = None
         self.current_text_watermark = None
@@ -40,11 +59,15 @@ class App(customtkinter.CTk):
         self.text_watermark_size = 100
         self.watermark_margin = 40
         self.watermark_text_color = (255, 255, 255)  # Default White
-        self.font = "fonts/Roboto-Regular.ttf"
+        self.font = str(FONTS_FOLDER / "Roboto-Regular.ttf")
 
         # Set default watermark opacity
         self.watermark_opacity = 100
 
+        # Set default spacing in pixels and angle in degrees of the tiled watermark pattern
+        self.tile_spacing = 100
+        self.tile_angle = 30
+
         # Set default save location for watermarked images
         self.save_location = "output"
 
@@ -52,15 +75,19 @@ class App(customtkinter.CTk):
         self.controls_frame.grid(row=0, column=0, rowspan=2, padx=(20, 10), pady=20, sticky="nsew")
 
         # Assign
-        self.controls_frame.add_image_btn.configure(command=lambda: self.new_thread(self.add_image))
+        self.controls_frame.add_image_btn.configure(command=self.add_image)
         self.controls_frame.delete_all_image_btn.configure(command=self.delete_all_image)
         self.controls_frame.watermark_size_slider.configure(command=self.adjust_watermark_size)
         self.controls_frame.watermark_opacity_slider.configure(command=self.adjust_watermark_opacity)
+        self.controls_frame.tile_spacing_slider.configure(command=self.adjust_tile_spacing)
+        self.controls_frame.tile_angle_slider.configure(command=self.adjust_tile_angle)
         self.controls_frame.save_location_btn.configure(command=self.choose_save_location)
         self.controls_frame.choose_image_watermark_btn.configure(command=self.choose_image_watermark)
         self.controls_frame.delete_image_btn.configure(command=self.delete_image)
         self.controls_frame.rotate_image_btn.configure(command=self.rotate_image)
-        self.controls_frame.save_images_btn.configure(command=lambda: self.new_thread(self.save_images))
+        self.controls_frame.save_images_btn.configure(command=self.save_images)
+        self.controls_frame.load_job_btn.configure(command=self.load_job_file)
+        self.controls_frame.save_job_btn.configure(command=self.save_job_file)
         self.controls_frame.tab_view.configure(command=lambda: self.update_watermark_preview(self.current_image_path))
         self.controls_frame.apply_text_watermark_btn.configure(command=self.get_text_watermark)
         self.controls_frame.text_color_chooser_btn.configure(command=self.get_text_watermark_color)
@@ -78,16 +105,28 @@ class App(customtkinter.CTk):
         self.create_watermark_preview_frame()
         self.create_image_preview_frame()
 
+        # Render watermark previews in the background so dragging the sliders doesn't block the app
+        self.preview_scheduler = PreviewScheduler(self, on_result=self.show_watermark_preview)
+
         # Setup progressbar
         self.progressbar = customtkinter.CTkProgressBar(self)
+        self.progress_label = customtkinter.CTkLabel(self, text="")
 
         # Add empty label to extend progress bar across full length of app window
         customtkinter.CTkLabel(self, text="     ").grid(row=0, column=2)
 
     def create_image_preview_frame(self):
-        """This method will create a DoubleScrolledFrame and display it on the main App window."""
-        self.image_preview_frame = DoubleScrolledFrame(
-            self, frame="image_preview", width=750, height=120, highlightbackground="#d1d5d8", highlightthickness=2
+        """This method will create a ThumbnailStrip and display it on the main App window. Clicking each thumbnail
+        will call the update_watermark_preview method to update watermark image preview."""
+        self.image_preview_frame = ThumbnailStrip(
+            self,
+            load_thumbnail=self.load_image_preview_thumbnail,
+            on_click=self.update_watermark_preview,
+            thumbnail_size=THUMBNAIL_SIZE,
+            width=750,
+            height=120,
+            highlightbackground="#d1d5d8",
+            highlightthickness=2,
         )
         self.image_preview_frame.grid(row=1, column=1, pady=(0, 20), sticky="news")
 
@@ -98,9 +137,13 @@ class App(customtkinter.CTk):
         )
         self.watermark_preview_frame.grid(row=0, column=1, pady=(20, 10), sticky="nsew")
 
+        # The label is created once and its image is swapped whenever a new preview is rendered
+        self.preview_image = customtkinter.CTkLabel(self.watermark_preview_frame, text="")
+
     def add_image(self):
-        """This method calls the Open File Dialog menu to let the user add one or more images, then stores the returned
-        list of files names to image_dictionary variable.
+        """This method calls the Open File Dialog menu to let the user add one or more images, then starts importing
+        them in the background. Thumbnails are added to the image preview frame as soon as each one is decoded, so the
+        user can start working on the first images while the rest are still loading.
 
         Returns:
             None: Returns None to stop this method if the user closed the file dialog menu without selecting
@@ -109,53 +152,97 @@ class App(customtkinter.CTk):
         self.file_paths = list(
             askopenfilenames(
                 title="Select the image(s) you want to watermark",
-                filetypes=[("image files", "*.png;*.jpeg;*.jpg;*.bmp;*.gif")],
+                filetypes=[("image files", "*.png;*.jpeg;*.jpg;*.bmp;*.gif;*.webp;*.tif;*.tiff;*.ppm")],
             )
         )
 
         # Check if user added image(s). If none, exit this function by returning None
-        if self.file_paths != []:
-            # Disable add button while images are added to avoid unwated issue during load process
-            self.controls_frame.add_image_btn.configure(state="disabled")
-            # Store number of items that need to be processed in tasks variable so it can be used
-            # to determine progressbar step count
-            tasks = len(self.file_paths)
-            for index, path in enumerate(self.file_paths):
-                # Update progress bar
-                index += 1
-                self.progress_value = index / tasks
-                self.progressbar.set(self.progress_value)
-                self.progressbar.grid(row=2, column=0, columnspan=3, sticky="ew")
-                self.update_idletasks()
-
-                # Check for duplicates and save any new paths to image_dictionary
-                if path not in self.image_dictionary:
-                    i = Image.open(path)
-                    i.thumbnail(THUMBNAIL_SIZE)
-                    self.image_dictionary[path] = {"rotate": 0, "transparency": 0, "imagetk": ImageTk.PhotoImage(i)}
-                else:
-                    print("Duplicate, skipped!")
-        else:
+        if self.file_paths == []:
             print("No Image was added")
             return None
 
-        # Hide progressbar once app is done adding all images
-        self.progressbar.grid_forget()
+        # Check for duplicates so only new paths are imported
+        new_paths = [path for path in dict.fromkeys(self.file_paths) if path not in self.image_dictionary]
+        if len(new_paths) < len(self.file_paths):
+            print(f"{len(self.file_paths) - len(new_paths)} duplicate(s), skipped!")
+        if not new_paths:
+            return None
+        self.import_images(new_paths)
 
-        # Set default current_image_path to the 1st image if it's first time importing image(s)
-        if not self.current_image_path:
-            self.current_image_path = list(self.image_dictionary.keys())[0]
+    def import_images(self, paths, rotations=None):
+        """This method starts importing the passed images in the background and adds them to the image preview frame
+        as they are decoded.
 
-        # Update image preview frames and enable widgets once all images are loaded
-        self.update_image_list_preview()
-        self.update_watermark_preview(self.current_image_path)
-        self.controls_frame.add_image_btn.configure(state="active")
-        self.enable_widgets()
+        Args:
+            paths (list): Full paths of the images to import. They must not be in image_dictionary yet.
+            rotations (dict, optional): Rotation to start each image with as {path: rotate}. Images without a rotation
+                start with the rotation stored in their EXIF orientation. Defaults to None.
+        """
+        rotations = rotations or {}
+
+        def get_rotation(path):
+            # Images start with the rotation stored in their EXIF orientation, so photos taken in portrait are upright
+            if rotations.get(path) is not None:
+                return rotations[path]
+            return image_loader.get_exif_rotation(path)
+
+        # Turn the add button into a cancel button while images are imported
+        self.image_importer = ImageImporter(
+            load_thumbnail=lambda path, rotate: image_loader.load_thumbnail(
+                path, THUMBNAIL_SIZE, rotate, self.thumbnail_cache
+            ),
+            get_rotation=get_rotation,
+        )
+        self.controls_frame.add_image_btn.configure(text="Cancel Import", command=self.image_importer.cancel)
+        self.controls_frame.save_images_btn.configure(state="disabled")
+        self.progressbar.set(0)
+        self.progressbar.grid(row=2, column=0, columnspan=3, sticky="ew")
+        self.progress_label.grid(row=3, column=0, columnspan=3)
+        self.image_importer.start(paths)
+        self.after(30, self.poll_image_import)
+
+    def poll_image_import(self):
+        """This method adds the images imported since the last call to image_dictionary and the image preview frame,
+        and updates the progressbar. It runs on the Tk thread until the import is done or cancelled.
+        """
+        importer = self.image_importer
+        for result in importer.get_results():
+            if not result.ok:
+                print(f"Failed to add {result.path}: {result.error}")
+                continue
+            self.image_dictionary[result.path] = {"rotate": result.rotate, "transparency": 0}
+            self.image_preview_frame.add(result.path, result.thumbnail)
+
+            # Show the 1st image and enable widgets as soon as it is loaded if it's first time importing image(s)
+            if not self.current_image_path:
+                self.current_image_path = result.path
+                self.update_watermark_preview(self.current_image_path)
+                self.enable_widgets()
+                self.controls_frame.save_images_btn.configure(state="disabled")
+
+        # Update progress bar
+        self.progress_value = importer.completed / importer.total
+        self.progressbar.set(self.progress_value)
+        self.progress_label.configure(
+            text=f"{importer.completed}/{importer.total} images ({importer.images_per_second:.1f} images/s)"
+        )
+
+        if not importer.done:
+            self.after(30, self.poll_image_import)
+            return
+
+        # Hide progressbar and enable widgets back once app is done adding all images
+        self.progressbar.grid_forget()
+        self.progress_label.grid_forget()
+        self.controls_frame.add_image_btn.configure(text="Add Image(s)", command=self.add_image)
+        if self.image_dictionary:
+            self.enable_widgets()
 
     def delete_image(self):
         """This method deletes the image currently displayed in the watermark_preview_frame from the image_dictionary
         variable."""
         # The code below will get the key/path of image next to the current image that will be deleted.
+        deleted_image = self.current_image_path
         self.next_image = None
         self.previous_image = None
         temp_dictionary = iter(self.image_dictionary)
@@ -179,30 +266,31 @@ class App(customtkinter.CTk):
             self.current_image_path = None
             self.current_image_watermark_path = None
             self.current_text_watermark = None
-            self.image_preview_buttons = None
             self.controls_frame.watermark_location_entry.configure(state="normal")
             self.controls_frame.watermark_location_entry.delete(0, "end")
             self.controls_frame.watermark_location_entry.configure(state="readonly")
             self.controls_frame.watermark_location_entry.delete(0, "end")
             self.disable_widgets()
 
-        self.update_image_list_preview()
+        self.image_preview_frame.remove(deleted_image)
         self.update_watermark_preview(self.current_image_path)
 
     def delete_all_image(self):
         """This methods deletes all images added by user and sets all selected watermark details back to None value."""
+        if self.image_importer:
+            self.image_importer.cancel()
+        self.preview_scheduler.cancel()
         self.image_dictionary.clear()
         self.current_image_path = None
+        self.preview_base = None
         self.current_image_watermark_path = None
         self.current_text_watermark = None
-        self.image_preview_buttons = None
         self.controls_frame.watermark_location_entry.configure(state="normal")
         self.controls_frame.watermark_location_entry.delete(0, "end")
         self.controls_frame.watermark_location_entry.configure(state="readonly")
         self.controls_frame.text_watermark_entry.delete(0, "end")
-        self.image_preview_frame.destroy()
+        self.image_preview_frame.clear()
         self.watermark_preview_frame.destroy()
-        self.create_image_preview_frame()
         self.create_watermark_preview_frame()
         self.disable_widgets()
 
@@ -219,15 +307,15 @@ class App(customtkinter.CTk):
         self.controls_frame.delete_image_btn.configure(state="active")
         self.controls_frame.rotate_image_btn.configure(state="active")
         self.controls_frame.save_images_btn.configure(state="active")
+        self.controls_frame.save_job_btn.configure(state="active")
         self.controls_frame.watermark_opacity_slider.configure(state="normal")
         self.controls_frame.watermark_size_slider.configure(state="normal")
+        self.controls_frame.tile_spacing_slider.configure(state="normal")
+        self.controls_frame.tile_angle_slider.configure(state="normal")
         for buttons in self.controls_frame.radiobuttons:
             buttons.configure(state="normal")
 
-        # Check if image_preview_buttons list is not empty before changing state to avoid error
-        if self.image_preview_buttons:
-            for button in self.image_preview_buttons:
-                button.configure(state="active")
+        self.image_preview_frame.set_button_state("active")
 
     def disable_widgets(self):
         """This method disables all widgets that are used for image operations."""
@@ -242,15 +330,15 @@ class App(customtkinter.CTk):
         self.controls_frame.delete_image_btn.configure(state="disabled")
         self.controls_frame.rotate_image_btn.configure(state="disabled")
         self.controls_frame.save_images_btn.configure(state="disabled")
+        self.controls_frame.save_job_btn.configure(state="disabled")
         self.controls_frame.watermark_opacity_slider.configure(state="disabled")
         self.controls_frame.watermark_size_slider.configure(state="disabled")
+        self.controls_frame.tile_spacing_slider.configure(state="disabled")
+        self.controls_frame.tile_angle_slider.configure(state="disabled")
         for radiobutton in self.controls_frame.radiobuttons:
             radiobutton.configure(state="disabled")
 
-        # Check if image_preview_buttons list is not empty before changing state to avoid error
-        if self.image_preview_buttons:
-            for button in self.image_preview_buttons:
-                button.configure(state="disabled")
+        self.image_preview_frame.set_button_state("disabled")
 
     def rotate_image(self):
         """This method updates the rotate value of the selected image in the image_dictionary by using the
@@ -264,72 +352,91 @@ class App(customtkinter.CTk):
         else:
             self.image_dictionary[self.current_image_path]["rotate"] = 0
 
-        # Update imagetk value to the rotated image
-        current_angle = self.image_dictionary[self.current_image_path]["rotate"]
-        original_image = Image.open(self.current_image_path)
-        original_image.thumbnail(THUMBNAIL_SIZE)
-        rotated_image = original_image.rotate(angle=current_angle, expand=True)
-        self.image_dictionary[self.current_image_path]["imagetk"] = ImageTk.PhotoImage(rotated_image)
-        self.update_image_list_preview()
+        # Reload the thumbnail of the rotated image
+        self.image_preview_frame.refresh(self.current_image_path)
         self.update_watermark_preview(self.current_image_path)
 
     def update_watermark_preview(self, image_path):
-        """This methods recreates the watermark_preview_frame to update the displayed images whenever there's any
-        modification on the selected image to be displayed. For example: An image was added or deleted, or the
-        watermark needs to be updated on the selected image.
+        """This methods requests the watermark_preview_frame to be updated whenever there's any modification on the
+        selected image to be displayed. For example: An image was added or deleted, or the watermark needs to be
+        updated on the selected image. The preview is rendered on the preview scheduler thread, and only the latest
+        request is shown once it is done.
 
         Args:
             image_path (str): Full path of the image that will be displayed inside watermark_preview_frame widget.
         """
-        self.watermark_preview_frame.destroy()
-        self.create_watermark_preview_frame()
-
-        # Exit function if passed image_path is empty/None value
+        # Clear the preview frame if passed image_path is empty/None value
         if not image_path:
+            self.preview_scheduler.cancel()
+            self.show_watermark_preview(None)
             return
 
         # Update current_image_path to store the selected image_path to show on watermark preview frame
         self.current_image_path = image_path
+        current_angle = self.image_dictionary[image_path]["rotate"]
+        self.preview_scheduler.schedule(
+            self.render_watermark_preview, image_path, current_angle, self.get_watermark_spec()
+        )
 
-        # If a watermark image is not available, open the image without applying watermark
-        # Otherwise, apply the watermark
-        if not self.current_image_watermark_path and not self.current_text_watermark:
-            self.result = Image.open(self.current_image_path)
-            self.result.thumbnail(FINAL_PREVIEW_SIZE)
-            current_angle = self.image_dictionary[self.current_image_path]["rotate"]
-            if current_angle > 0:
-                self.result = self.result.rotate(angle=current_angle, expand=True)
-        else:
-            self.result = self.apply_watermark(self.current_image_path)
-            self.result.thumbnail(FINAL_PREVIEW_SIZE)
+    def render_watermark_preview(self, image_path, rotate, spec):
+        """This method renders the watermark preview of the passed image. It runs on the preview scheduler thread so
+        it must not touch any widget.
+
+        Args:
+            image_path (str): Full path of the image to preview.
+            rotate (int): Counter-clockwise rotation in degrees stored for the image.
+            spec (WatermarkSpec): Watermark settings to preview.
+
+        Returns:
+            PIL Image: The preview sized image with the watermark applied.
+        """
+        # The preview is always rendered from a copy of the image that is already shrunk to the preview size. It is
+        # decoded once per image and rotation, so slider changes only composite a preview sized image.
+        preview_key = (image_path, rotate)
+        preview_base = self.preview_base
+        if preview_base is None or preview_base[0] != preview_key:
+            preview_base = (
+                preview_key,
+                image_loader.load_thumbnail(image_path, FINAL_PREVIEW_SIZE, rotate),
+                image_loader.get_image_size(image_path, rotate),
+            )
+            self.preview_base = preview_base
+        _, preview_image, original_size = preview_base
+
+        # If a watermark is not available, show the image without applying watermark
+        # Otherwise, apply the watermark scaled down to the preview size
+        if not spec.has_watermark:
+            return preview_image
+        return watermark_engine.render_preview(preview_image, original_size, spec)
+
+    def show_watermark_preview(self, result):
+        """This method swaps the image displayed in the watermark_preview_frame with a rendered preview. It is called
+        on the Tk thread by the preview scheduler.
 
+        Args:
+            result (PIL Image): The rendered preview, or None to leave the frame empty.
+        """
+        if result is None:
+            self.preview_image.grid_remove()
+            return
+
+        self.result = result
         self.imagetk = customtkinter.CTkImage(light_image=self.result, size=self.result.size)
-        self.preview_image = customtkinter.CTkLabel(self.watermark_preview_frame, image=self.imagetk, text="")
+        self.preview_image.configure(image=self.imagetk)
         self.preview_image.grid(row=0, column=0, padx=25, pady=10, sticky="news")
 
-    def update_image_list_preview(self):
-        """This methods recreates the image_preview_frame to update the displayed images whenever an image is added
-        or deleted.
-        """
-        self.image_preview_frame.destroy()
-        self.create_image_preview_frame()
-        self.watermark_preview_frame.destroy()
-        self.create_watermark_preview_frame()
+    def load_image_preview_thumbnail(self, image_path):
+        """This method returns the rotated thumbnail of the passed image for the image_preview_frame. It is called on
+        a background thread by the ThumbnailStrip, only for thumbnails that are about to be shown.
 
-        # Display all images in a vertical row using button widgets. Clicking each image buttons will call the
-        # update_watermark_preview method to update watermark image preview
-        self.image_preview_buttons = []
-        for index, path in enumerate(self.image_dictionary.keys()):
-            self.image_preview_buttons.append(
-                Button(
-                    self.image_preview_frame,
-                    image=self.image_dictionary[path].get("imagetk"),
-                    text="",
-                    borderwidth=0,
-                    command=lambda path=path: self.update_watermark_preview(path),
-                )
-            )
-            self.image_preview_buttons[index].grid(row=0, column=index, padx=10, pady=5)
+        Args:
+            image_path (str): Full path of the image, used as key in image_dictionary.
+
+        Returns:
+            PIL Image: Thumbnail of the image, rotated by the rotate value stored in image_dictionary.
+        """
+        current_angle = self.image_dictionary.get(image_path, {}).get("rotate", 0)
+        return image_loader.load_thumbnail(image_path, THUMBNAIL_SIZE, current_angle, self.thumbnail_cache)
 
     def choose_image_watermark(self):
         """This method will prompt the user to choose an image to use as watermark. It then saves the path of selected
@@ -337,7 +444,7 @@ class App(customtkinter.CTk):
         """
         self.current_image_watermark_path = askopenfilename(
             title="Choose the watermark image you want to use",
-            filetypes=[("image files", "*.png;*.jpeg;*.jpg;*.bmp;*.gif")],
+            filetypes=[("image files", "*.png;*.jpeg;*.jpg;*.bmp;*.gif;*.webp")],
         )
         if self.current_image_watermark_path:
             self.controls_frame.watermark_location_entry.configure(state="normal")
@@ -346,72 +453,37 @@ class App(customtkinter.CTk):
             self.controls_frame.watermark_location_entry.configure(state="readonly")
             self.update_watermark_preview(self.current_image_path)
 
-    def apply_watermark(self, image_path):
-        """This method applies a watermark to the passed image path. Depending on the current tab
-        selected on the tab_view widget, it will either apply a text or image watermark to the original image.
-
-        Args:
-            image_path (str): Full path of the image where the watermark will be applied to.
+    def get_watermark_spec(self):
+        """Collects the watermark settings currently chosen on the app widgets into an immutable WatermarkSpec that
+        can be passed to the watermark engine from any thread or process.
 
         Returns:
-            PIL Image: Returns a PIL Image Object of the image with applied watermark.
+            WatermarkSpec: Snapshot of the current watermark settings.
         """
-        self.original_image = Image.open(image_path)
-        current_angle = self.image_dictionary[image_path]["rotate"]
-        if current_angle > 0:
-            self.original_image = self.original_image.rotate(angle=current_angle, expand=True)
-
-        self.original_image_width, self.original_image_height = self.original_image.size
-        self.watermarked_image = Image.new(
-            mode="RGBA", size=(self.original_image_width, self.original_image_height), color=(0, 0, 0, 0)
-        )
-        self.watermarked_image.paste(self.original_image, (0, 0))
-
-        # Apply the watermark based on the current tab(Image or Text) selected by the user.
         current_tab = self.controls_frame.tab_view.get()
-        if current_tab == "Image Watermark" and self.current_image_watermark_path:
-            self.watermark = Image.open(self.current_image_watermark_path)
-
-            # Adjust watermark size to be pasted based on the watermark_size value chosen by user. Default is 300px
-            self.watermark.thumbnail(self.image_watermark_size)
-
-            # Adjust watermark opacity on a percent scale. Convert image to RGBA if it doesn't have transparency.
-            if self.watermark.mode != "RGBA":
-                self.watermark = self.watermark.convert("RGBA")
-                alpha = Image.new("L", self.watermark.size, 255)
-                self.watermark.putalpha(alpha)
-            paste_mask = self.watermark.split()[3].point(lambda i: i * self.watermark_opacity / 100.0)
-            self.watermarked_image.paste(
-                self.watermark, self.get_watermark_position(self.watermark.size), mask=paste_mask
-            )
-
-        elif current_tab == "Text Watermark" and self.current_text_watermark:
-            # Make a blank image for the text, initialized to transparent text color
-            txt = Image.new("RGBA", (self.original_image_width, self.original_image_height), (255, 255, 255, 0))
-            # Set a font
-            font = ImageFont.truetype(self.font, self.text_watermark_size)
-            # Get a drawing context
-            d = ImageDraw.Draw(txt)
-
-            # Calculate the size of text watermark input
-            text_size = d.textsize(text=self.current_text_watermark, font=font)
-
-            # This section will draw the text.
-            # Get the RGB values from self.watermark_text_color and apply it to fill
-            R, G, B = self.watermark_text_color
-            # This will compute the correct alpha value based on the current percentage value of opacity slider.
-            A = int(255 * (self.watermark_opacity * 0.01))
-            d.text(
-                xy=self.get_watermark_position(text_size),
-                text=self.current_text_watermark,
-                font=font,
-                fill=(R, G, B, A),
-            )
+        return WatermarkSpec(
+            mode="image" if current_tab == "Image Watermark" else "text",
+            image_watermark_path=self.current_image_watermark_path or None,
+            text=self.current_text_watermark or None,
+            position=self.controls_frame.watermark_position.get(),
+            image_watermark_size=self.image_watermark_size,
+            text_watermark_size=self.text_watermark_size,
+            margin=self.watermark_margin,
+            text_color=tuple(self.watermark_text_color),
+            font=self.font,
+            opacity=self.watermark_opacity,
+            tile_spacing=self.tile_spacing,
+            tile_angle=self.tile_angle,
+        )
 
-            # Combine the watermarked image with the transparent blank image containing the text
-            self.watermarked_image = Image.alpha_composite(self.watermarked_image, txt)
+    def get_output_profile(self):
+        """This method returns the output profile selected in the Output Format option menu.
 
-        return self.watermarked_image
+        Returns:
+            OutputProfile: Format and encoder settings used to save the watermarked images.
+        """
+        label = self.controls_frame.output_profile_option_menu.get()
+        return next(profile for profile in OUTPUT_PROFILES.values() if profile.label == label)
 
     def get_text_watermark(self, event=None):
         """This method updates the current_text_watermark variable to store the returned current string from the
@@ -430,7 +502,7 @@ class App(customtkinter.CTk):
         Args:
             font (str): This stores the font name value passed on by the font_option_menu widget.
         """
-        self.font = f"fonts/{font}.ttf"
+        self.font = self.controls_frame.font_catalog.path(font)
         # Call get_text_watermark method to update the text input before applying new font
         self.get_text_watermark()
 
@@ -468,34 +540,23 @@ class App(customtkinter.CTk):
         self.watermark_opacity = int(opacity)
         self.update_watermark_preview(self.current_image_path)
 
-    def get_watermark_position(self, watermark_size):
-        """Calculates x and y positions where watermark will be placed based on the image or text watermark size.
+    def adjust_tile_spacing(self, spacing):
+        """This method captures the current value of tile_spacing_slider widget and stores it on tile_spacing variable.
 
-        Returns:
-            tuple: A tuple containing (x, y) positions in pixels based on the image or text watermark size.
+        Args:
+            spacing (float): This stores the value passed on by the tile_spacing_slider widget.
         """
+        self.tile_spacing = int(spacing)
+        self.update_watermark_preview(self.current_image_path)
 
-        watermark_width = watermark_size[0]
-        watermark_height = watermark_size[1]
-
-        if self.controls_frame.watermark_position.get() == "bottom-left":
-            return (self.watermark_margin, self.original_image_height - watermark_height - self.watermark_margin)
-        elif self.controls_frame.watermark_position.get() == "top-left":
-            return (self.watermark_margin, self.watermark_margin)
-        # FIXME - bottom-right alignment of watermark is messed up - FIXED: Issue - I just used watermark_size
-        # instead of watermark.size attribute
-        elif self.controls_frame.watermark_position.get() == "bottom-right":
-            return (
-                self.original_image_width - watermark_width - self.watermark_margin,
-                self.original_image_height - watermark_height - self.watermark_margin,
-            )
-        elif self.controls_frame.watermark_position.get() == "top-right":
-            return (self.original_image_width - watermark_width - self.watermark_margin, self.watermark_margin)
-        elif self.controls_frame.watermark_position.get() == "center":
-            return (
-                round(self.original_image_width * 0.50 - (watermark_width * 0.50)),
-                round(self.original_image_height * 0.50 - (watermark_height * 0.50)),
-            )
+    def adjust_tile_angle(self, angle):
+        """This method captures the current value of tile_angle_slider widget and stores it on tile_angle variable.
+
+        Args:
+            angle (float): This stores the value passed on by the tile_angle_slider widget.
+        """
+        self.tile_angle = int(angle)
+        self.update_watermark_preview(self.current_image_path)
 
     def choose_save_location(self):
         """This method will prompt the user to choose a save location for watermarked images, and store the save path
@@ -525,32 +586,178 @@ class App(customtkinter.CTk):
         # to determine progressbar step count
         tasks = len(self.image_dictionary)
 
-        # Disable widgets while saving images to avoid unwated user modification during save process
+        # Disable widgets while saving images to avoid unwated user modification during save process. The save button
+        # is turned into a cancel button for the duration of the export.
         self.disable_widgets()
         self.controls_frame.add_image_btn.configure(state="disabled")
+        self.controls_frame.load_job_btn.configure(state="disabled")
+        self.controls_frame.export_workers_option_menu.configure(state="disabled")
+        self.controls_frame.output_profile_option_menu.configure(state="disabled")
+
+        # Take a snapshot of the watermark settings once so every image in the batch gets the same watermark
+        self.batch_exporter = BatchExporter(
+            spec=self.get_watermark_spec(),
+            save_location=self.save_location,
+            workers=int(self.controls_frame.export_workers_option_menu.get()),
+            profile=self.get_output_profile(),
+        )
+        self.controls_frame.save_images_btn.configure(
+            text="Cancel", state="active", command=self.batch_exporter.cancel
+        )
 
-        for index, image_path in enumerate(self.image_dictionary.keys()):
-            # Convert mode of the returned image from apply_watermark method to "RGB" to allow saving image in original
-            # format that might not support "RGBA" e.g. JPEG.
-            watermarked_image = self.apply_watermark(image_path).convert("RGB")
-            watermarked_image.save(
-                fp=f"{self.save_location}/{Path(image_path).stem}_watermarked{Path(image_path).suffix}"
-            )
+        # The export runs on its own thread and hands its progress back through a queue, as Tk widgets may only be
+        # touched from the Tk thread
+        self.export_progress = queue.Queue()
+        images = [(image_path, attributes["rotate"]) for image_path, attributes in self.image_dictionary.items()]
 
-            # Update progress bar
-            index += 1
-            self.progress_value = index / tasks
+        def export():
+            try:
+                self.export_failures = self.batch_exporter.run(
+                    images, on_progress=lambda completed, result: self.export_progress.put((completed, result))
+                )
+            finally:
+                # Sentinel telling poll_image_export the export is over
+                self.export_progress.put(None)
+
+        self.export_failures = []
+        self.export_tasks = tasks
+        self.new_thread(export)
+        self.after(30, self.poll_image_export)
+
+    def poll_image_export(self):
+        """This method updates the progressbar with the images saved since the last call and restores the widgets once
+        the export is done. It runs on the Tk thread until the export started by save_images is over.
+        """
+        tasks = self.export_tasks
+        while True:
+            try:
+                progress = self.export_progress.get_nowait()
+            except queue.Empty:
+                self.after(30, self.poll_image_export)
+                return
+            if progress is None:
+                break
+            completed, result = progress
+            if not result.ok:
+                print(f"Failed to save {result.image_path}: {result.error}")
+            for other_source in result.replaced:
+                print(f"{result.output_path} was the export of {other_source}, replaced by {result.image_path}")
+            self.progress_value = completed / tasks
             self.progressbar.set(self.progress_value)
             self.progressbar.grid(row=2, column=0, columnspan=2, sticky="ew")
-            self.update_idletasks()
 
         # Hide progressbar once app is done saving all images
         self.progressbar.grid_forget()
 
         # Enable widgets back once done saving all images
+        self.controls_frame.save_images_btn.configure(text="Save All Images", command=self.save_images)
+        self.controls_frame.export_workers_option_menu.configure(state="normal")
+        self.controls_frame.output_profile_option_menu.configure(state="normal")
         self.controls_frame.add_image_btn.configure(state="active")
+        self.controls_frame.load_job_btn.configure(state="active")
         self.enable_widgets()
 
+        failures = self.export_failures
+        if failures:
+            failed_images = "\n".join(Path(result.image_path).name for result in failures[:10])
+            if len(failures) > 10:
+                failed_images += f"\n...and {len(failures) - 10} more"
+            messagebox.showwarning(
+                title="Some images were not saved",
+                message=f"{len(failures)} of {tasks} image(s) could not be saved:\n{failed_images}",
+            )
+
+    def save_job_file(self):
+        """This method saves the current watermark settings, output options and images with their rotation to a job
+        file chosen by the user, so the same batch can be loaded again later or run with the command line tool.
+        """
+        path = asksaveasfilename(
+            title="Save Job", defaultextension=".json", filetypes=[("job files", "*.json")], initialfile="job.json"
+        )
+        if not path:
+            return
+        job = job_file.Job(
+            spec=self.get_watermark_spec(),
+            images=[(image_path, attributes["rotate"]) for image_path, attributes in self.image_dictionary.items()],
+            save_location=self.save_location,
+            profile=self.get_output_profile().name,
+            workers=int(self.controls_frame.export_workers_option_menu.get()),
+        )
+        try:
+            job_file.save_job(job, path)
+        except OSError as error:
+            messagebox.showerror(title="Could not save job", message=str(error))
+
+    def load_job_file(self):
+        """This method loads a job file chosen by the user. The images currently added are replaced by the images of
+        the job, and every watermark setting and output option is set to the value stored in the job.
+        """
+        path = askopenfilename(title="Load Job", filetypes=[("job files", "*.json;*.toml")])
+        if not path:
+            return
+        try:
+            job = job_file.load_job(path)
+        except (OSError, ValueError) as error:
+            messagebox.showerror(title="Could not load job", message=str(error))
+            return
+
+        self.delete_all_image()
+        self.apply_job_settings(job)
+        paths = list(dict.fromkeys(image_path for image_path, _ in job.images))
+        if paths:
+            self.import_images(paths, rotations=dict(job.images))
+
+    def apply_job_settings(self, job):
+        """This method sets the app widgets and watermark variables to the settings stored in a job.
+
+        Args:
+            job (Job): The loaded job.
+        """
+        spec = job.spec
+        self.controls_frame.tab_view.set("Image Watermark" if spec.mode == "image" else "Text Watermark")
+
+        self.current_image_watermark_path = spec.image_watermark_path
+        self.controls_frame.watermark_location_entry.configure(state="normal")
+        self.controls_frame.watermark_location_entry.delete(0, "end")
+        self.controls_frame.watermark_location_entry.insert(0, spec.image_watermark_path or "")
+        self.controls_frame.watermark_location_entry.configure(state="readonly")
+
+        # The text entry is disabled until images are added, so it is enabled just long enough to fill it in
+        self.current_text_watermark = spec.text
+        text_entry_state = self.controls_frame.text_watermark_entry.cget("state")
+        self.controls_frame.text_watermark_entry.configure(state="normal")
+        self.controls_frame.text_watermark_entry.delete(0, "end")
+        self.controls_frame.text_watermark_entry.insert(0, spec.text or "")
+        self.controls_frame.text_watermark_entry.configure(state=text_entry_state)
+
+        self.font = spec.font
+        if Path(spec.font).stem in self.controls_frame.fonts:
+            self.controls_frame.font_option_menu.set(Path(spec.font).stem)
+        self.watermark_text_color = tuple(spec.text_color)
+        self.controls_frame.watermark_position.set(spec.position)
+
+        # Sizes are restored exactly, the size slider only shows the closest value it can
+        self.image_watermark_size = tuple(spec.image_watermark_size)
+        self.text_watermark_size = spec.text_watermark_size
+        self.controls_frame.watermark_size_slider.set(spec.image_watermark_size[0])
+        self.watermark_margin = spec.margin
+        self.watermark_opacity = spec.opacity
+        self.controls_frame.watermark_opacity_slider.set(spec.opacity)
+        self.tile_spacing = spec.tile_spacing
+        self.controls_frame.tile_spacing_slider.set(spec.tile_spacing)
+        self.tile_angle = spec.tile_angle
+        self.controls_frame.tile_angle_slider.set(spec.tile_angle)
+
+        self.save_location = job.save_location
+        self.controls_frame.save_location_entry.configure(state="normal")
+        self.controls_frame.save_location_entry.delete(0, "end")
+        self.controls_frame.save_location_entry.insert(0, self.save_location)
+        self.controls_frame.save_location_entry.configure(state="readonly")
+
+        self.controls_frame.output_profile_option_menu.set(OUTPUT_PROFILES[job.profile].label)
+        if job.workers and str(job.workers) in self.controls_frame.export_workers:
+            self.controls_frame.export_workers_option_menu.set(str(job.workers))
+
     def new_thread(self, target):
         """This method will start a new thread for the target callable object.
 
@@ -0,0 +1,175 @@
+"""Output encoding profiles for exported images.
+
+A profile picks the format watermarked images are saved in and the encoder settings used for it, trading encode time
+against file size. Every profile passes the EXIF and ICC metadata of the source image through to the output when the
+format supports it.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from pathlib import Path
+
+from PIL import Image
+
+from watermark_engine import EXIF_ORIENTATION, get_exif_rotation
+
+# Formats that can store an alpha channel
+ALPHA_FORMATS = {"PNG", "WEBP", "TIFF"}
+
+# Color space signature in the header of an ICC profile for the image modes it can describe
+ICC_COLOR_SPACES = {"RGB": b"RGB ", "RGBA": b"RGB ", "L": b"GRAY", "LA": b"GRAY", "CMYK": b"CMYK"}
+
+# Offset of the color space signature in the header of an ICC profile
+ICC_COLOR_SPACE_OFFSET = 16
+
+
+@dataclass(frozen=True)
+class OutputProfile:
+    """Format and encoder settings used to save watermarked images.
+
+    Attributes:
+        name (str): Short name of the profile used on the command line.
+        label (str): Name of the profile shown in the app.
+        format (str): PIL format name the images are saved in. None keeps the format of each source image.
+        suffix (str): File extension of the saved images, None keeps the extension of each source image.
+        save_options (dict): Keyword arguments passed to the encoder.
+        keep_alpha (bool): Keep the transparency of sources that have one if the format can store it.
+    """
+
+    name: str
+    label: str
+    format: str = None
+    suffix: str = None
+    save_options: dict = field(default_factory=dict)
+    keep_alpha: bool = True
+
+    def get_suffix(self, image_path):
+        """Returns the file extension of the watermarked copy of image_path."""
+        return self.suffix or Path(image_path).suffix
+
+    def get_format(self, image_path):
+        """Returns the PIL format name the watermarked copy of image_path is saved in, None if it is unknown."""
+        return self.format or Image.registered_extensions().get(self.get_suffix(image_path).lower())
+
+    def get_mode(self, image, image_path):
+        """Returns the mode, "RGB" or "RGBA", the watermarked copy of a decoded image has to be in before saving.
+
+        Args:
+            image (PIL Image): The decoded source image.
+            image_path (str): Full path of the source image.
+        """
+        output_format = self.get_format(image_path)
+        has_alpha = "A" in image.getbands() or "transparency" in image.info
+        return "RGBA" if self.keep_alpha and has_alpha and output_format in ALPHA_FORMATS else "RGB"
+
+    def save(self, image, output_path, rotate=None):
+        """Encodes a watermarked image to output_path with the settings of this profile and the metadata of its
+        source. The image is written to a temporary file first, so output_path never holds a half written image.
+
+        Args:
+            image (PIL Image): The watermarked image. Its info holds the metadata of the source image.
+            output_path (str): Full path the image is saved to.
+            rotate (int, optional): Counter-clockwise rotation the image was loaded with. None if it was made upright
+                with its EXIF orientation. Defaults to None.
+        """
+        options = dict(self.save_options)
+        options.update(get_metadata(image, rotate=rotate))
+        output_format = self.format or Image.registered_extensions().get(Path(output_path).suffix.lower())
+        with open_output(output_path) as file:
+            image.save(file, format=output_format, **options)
+
+
+@contextmanager
+def open_output(output_path):
+    """Opens a temporary file next to output_path for writing and moves it to output_path once the wrapped code is
+    done, so output_path never holds a half written image. The temporary file is removed if the wrapped code raises.
+
+    Args:
+        output_path (str): Full path the file is saved to.
+
+    Yields:
+        file: The temporary file, opened in binary mode.
+    """
+    output_path = Path(output_path)
+    # Unique per process and thread, and created with the same permissions a direct save would get
+    temp_path = output_path.with_name(f".{output_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(temp_path, "wb") as file:
+            yield file
+        os.replace(temp_path, output_path)
+    except BaseException:
+        temp_path.unlink(missing_ok=True)
+        raise
+
+
+def get_metadata(image, mode=None, rotate=None):
+    """Returns the EXIF and ICC metadata of a decoded image as save() keyword arguments.
+
+    The EXIF orientation is reset when the pixels were loaded with an explicit rotation, as they are then stored the
+    way they were previewed, and when the EXIF orientation itself was applied to them. Pixels left as they are in the
+    file, e.g. with a mirrored orientation, keep the orientation of their source. The EXIF thumbnail is dropped as it
+    would show the image without the watermark. The ICC profile is only kept if it describes the color space the
+    pixels are saved in: pixels converted from another color space, e.g. CMYK to RGB, are plain conversions that a
+    CMYK profile would make viewers render wrongly.
+
+    Args:
+        image (PIL Image): Image whose info holds the metadata read from its file.
+        mode (str, optional): Mode of the pixels that are saved. Defaults to the mode of image.
+        rotate (int, optional): Counter-clockwise rotation applied to the pixels when loading them. None if they were
+            made upright with the EXIF orientation. Defaults to None.
+
+    Returns:
+        dict: "exif" and "icc_profile" arguments for the metadata the image has.
+    """
+    metadata = {}
+    icc_profile = image.info.get("icc_profile")
+    color_space = ICC_COLOR_SPACES.get(mode or image.mode)
+    if icc_profile and icc_profile[ICC_COLOR_SPACE_OFFSET : ICC_COLOR_SPACE_OFFSET + 4] == color_space:
+        metadata["icc_profile"] = icc_profile
+    if image.info.get("exif"):
+        exif = image.getexif()
+        if EXIF_ORIENTATION in exif and (rotate is not None or get_exif_rotation(image)):
+            exif[EXIF_ORIENTATION] = 1
+        metadata["exif"] = exif.tobytes()
+    return metadata
+
+
+OUTPUT_PROFILES = {
+    profile.name: profile
+    for profile in (
+        OutputProfile(name="original", label="Keep Original"),
+        OutputProfile(
+            name="fast-jpeg",
+            label="Fast JPEG",
+            format="JPEG",
+            suffix=".jpg",
+            save_options={"quality": 85, "optimize": False, "progressive": False},
+            keep_alpha=False,
+        ),
+        OutputProfile(
+            name="small-jpeg",
+            label="Small JPEG",
+            format="JPEG",
+            suffix=".jpg",
+            save_options={"quality": 80, "optimize": True, "progressive": True},
+            keep_alpha=False,
+        ),
+        OutputProfile(
+            name="web-webp",
+            label="Web WebP",
+            format="WEBP",
+            suffix=".webp",
+            save_options={"quality": 80, "method": 4},
+        ),
+        OutputProfile(
+            name="archival-png",
+            label="Archival PNG",
+            format="PNG",
+            suffix=".png",
+            save_options={"compress_level": 1},
+        ),
+    )
+}
+
+DEFAULT_PROFILE = OUTPUT_PROFILES["original"]
@@ -0,0 +1,88 @@
+"""Debounced background rendering of the watermark preview.
+
+Sliders fire a command on every motion event. Rendering the preview for each of them on the Tk thread makes dragging
+stutter and queues up renders that are already outdated. The PreviewScheduler renders on its own thread instead,
+waits for a short pause in the requests before starting, skips requests that were superseded by a newer one, and
+only hands the latest result back to the Tk thread.
+"""
+import queue
+import threading
+import time
+import traceback
+
+
+class PreviewScheduler:
+    """Renders previews on a background thread and delivers the latest result on the Tk thread.
+
+    Args:
+        widget (tkinter widget): Widget used to poll for finished renders with after(). Results are delivered on the
+            thread running its mainloop.
+        on_result (callable): Called on the Tk thread with the value returned by the latest render.
+        delay (int, optional): Milliseconds to wait for newer requests before rendering. Defaults to 30.
+        poll_interval (int, optional): Milliseconds between two checks for finished renders. Defaults to 15.
+    """
+
+    def __init__(self, widget, on_result, delay=30, poll_interval=15):
+        self.widget = widget
+        self.on_result = on_result
+        self.delay = delay / 1000
+        self.poll_interval = poll_interval
+
+        self._condition = threading.Condition()
+        # Latest requested render as (generation, deadline, render, args). Only the latest request is kept.
+        self._request = None
+        self._generation = 0
+        self._results = queue.Queue()
+
+        self._thread = threading.Thread(target=self._run, name="PreviewScheduler", daemon=True)
+        self._thread.start()
+        self.widget.after(self.poll_interval, self._poll)
+
+    def schedule(self, render, *args):
+        """Requests render(*args) to run on the background thread, replacing any request that has not started yet.
+        Safe to call from any thread.
+
+        Args:
+            render (callable): Function returning the rendered preview.
+            *args: Arguments passed to render.
+        """
+        with self._condition:
+            self._generation += 1
+            self._request = (self._generation, time.monotonic() + self.delay, render, args)
+            self._condition.notify()
+
+    def cancel(self):
+        """Drops the pending request and any render still in progress. Safe to call from any thread."""
+        with self._condition:
+            self._generation += 1
+            self._request = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                # Wait for a request, then keep waiting until no newer request came in for the whole delay
+                while self._request is None or time.monotonic() < self._request[1]:
+                    timeout = None if self._request is None else self._request[1] - time.monotonic()
+                    self._condition.wait(timeout)
+                generation, _, render, args = self._request
+                self._request = None
+
+            try:
+                result = render(*args)
+            except Exception:
+                traceback.print_exc()
+                continue
+            self._results.put((generation, result))
+
+    def _poll(self):
+        latest = None
+        while True:
+            try:
+                latest = self._results.get_nowait()
+            except queue.Empty:
+                break
+
+        # A result is only shown if no newer request was made while it was rendering
+        if latest is not None and latest[0] == self._generation:
+            self.on_result(latest[1])
+        self.widget.after(self.poll_interval, self._poll)
@@ -0,0 +1,201 @@
+"""Per-stage profiling of batch exports.
+
+When telemetry is on, every exported image records how long it spent decoding, rotating, converting, compositing and
+encoding, how many bytes were read and written and the peak memory of the process that exported it. Records are
+appended to a JSON lines log and summed up per stage at the end of the batch, which makes outliers like CMYK TIFFs or
+100 MP panoramas easy to find in production runs.
+
+Telemetry is switched on by passing a Telemetry to the BatchExporter, with --telemetry on the command line, or by
+setting the WATERMARK_TELEMETRY environment variable to the path of the log. When it is off, every stage costs a
+single check of a None timer.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# Environment variable holding the path of the telemetry log, telemetry is off when it isn't set
+ENV_VAR = "WATERMARK_TELEMETRY"
+
+# Stages in the order an image goes through them, used to order the summary
+STAGES = ("decode", "rotate", "convert", "composite", "encode")
+
+# Number of slowest images listed in the summary
+SLOWEST_COUNT = 5
+
+# Shared context manager used for every stage when telemetry is off
+_NO_TIMING = nullcontext()
+
+
+def stage(timer, name):
+    """Returns a context manager timing the code it wraps as stage name of timer, or doing nothing if timer is None.
+
+    Args:
+        timer (StageTimer): Timer of the image being processed, None when telemetry is off.
+        name (str): Name of the stage, see STAGES.
+    """
+    return _NO_TIMING if timer is None else timer.stage(name)
+
+
+def percentile(values, percent):
+    """Returns the nearest-rank percentile of values."""
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(percent / 100 * len(ordered) + 0.5) - 1))
+    return ordered[rank]
+
+
+def reset_peak_memory():
+    """Resets the peak resident memory of the process where the OS allows it (Linux), so the next reading of
+    get_peak_memory only covers what ran since."""
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def get_peak_memory():
+    """Returns the peak resident memory of the process in MB, or None if it can't be measured."""
+    try:
+        with open("/proc/self/status") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def get_file_size(path):
+    """Returns the size of the file on path in bytes, or None if it can't be read."""
+    try:
+        return os.stat(path).st_size
+    except (OSError, TypeError):
+        return None
+
+
+class StageTimer:
+    """Collects the stage timings and details of a single image. The stages of an image may run on different threads,
+    but never at the same time. The total time runs from the creation of the timer to finish, so it also includes the
+    time an image waited between stages."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        # Seconds spent in every stage
+        self.stages = {}
+        # Properties of the source image, e.g. its size and mode
+        self.details = {}
+
+    @contextmanager
+    def stage(self, name):
+        """Times the wrapped code as stage name, adding to any time already spent in that stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, result):
+        """Stores the record of the image in result.stats.
+
+        Args:
+            result (ExportResult): Result of the export of the image.
+
+        Returns:
+            ExportResult: The passed result.
+        """
+        result.stats = {
+            "image": result.image_path,
+            "output": result.output_path,
+            "error": result.error,
+            **self.details,
+            "bytes_read": get_file_size(result.image_path),
+            "bytes_written": get_file_size(result.output_path) if result.ok else None,
+            "stages_ms": {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+            "total_ms": round((time.perf_counter() - self.start) * 1000, 3),
+            "peak_memory_mb": get_peak_memory(),
+            "pid": os.getpid(),
+        }
+        return result
+
+
+class Telemetry:
+    """Writes the stage records of exported images to a JSON lines log and sums them up per stage. Safe to use from
+    several threads.
+
+    Args:
+        log_path (str): Path of the log. Records are appended if it already exists.
+    """
+
+    def __init__(self, log_path):
+        self.log_path = log_path
+        self._lock = threading.Lock()
+        self._file = open(log_path, "a", encoding="utf-8")
+        self._durations = {}
+        self._slowest = []
+        self.count = 0
+        self.failed = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.peak_memory_mb = 0.0
+
+    @classmethod
+    def from_environment(cls):
+        """Returns a Telemetry writing to the log named by the WATERMARK_TELEMETRY environment variable, or None if
+        it isn't set."""
+        log_path = os.environ.get(ENV_VAR)
+        return cls(log_path) if log_path else None
+
+    def record(self, stats):
+        """Adds the record of one image, as stored in ExportResult.stats by StageTimer.finish."""
+        with self._lock:
+            self._file.write(json.dumps(stats) + "\n")
+            # Hand every record to the OS right away so the log is complete even if the batch is interrupted
+            self._file.flush()
+            self.count += 1
+            self.failed += stats["error"] is not None
+            self.bytes_read += stats["bytes_read"] or 0
+            self.bytes_written += stats["bytes_written"] or 0
+            self.peak_memory_mb = max(self.peak_memory_mb, stats["peak_memory_mb"] or 0.0)
+            for name, milliseconds in stats["stages_ms"].items():
+                self._durations.setdefault(name, []).append(milliseconds)
+            self._slowest.append((stats["total_ms"], stats))
+            self._slowest = sorted(self._slowest, key=lambda item: item[0], reverse=True)[:SLOWEST_COUNT]
+
+    def summary(self):
+        """Returns a text table of the time spent per stage over every recorded image, and the slowest images."""
+        with self._lock:
+            lines = [f"Export telemetry for {self.count} images ({self.failed} failed), log: {self.log_path}"]
+            lines.append(f"  {'stage':<10} {'total s':>9} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9}")
+            names = [name for name in STAGES if name in self._durations]
+            names += sorted(name for name in self._durations if name not in STAGES)
+            for name in names:
+                durations = self._durations[name]
+                lines.append(
+                    f"  {name:<10} {sum(durations) / 1000:>9.2f} {sum(durations) / len(durations):>9.1f}"
+                    f" {percentile(durations, 95):>9.1f} {max(durations):>9.1f}"
+                )
+            lines.append(
+                f"  read {self.bytes_read / 1024 ** 2:.1f} MB, wrote {self.bytes_written / 1024 ** 2:.1f} MB,"
+                f" peak memory {self.peak_memory_mb:.0f} MB"
+            )
+            if self._slowest:
+                lines.append("  slowest images:")
+                for total_ms, stats in self._slowest:
+                    details = " ".join(str(stats[key]) for key in ("format", "mode") if stats.get(key))
+                    size = f"{stats['width']}x{stats['height']} " if "width" in stats else ""
+                    lines.append(f"    {total_ms:>9.1f} ms  {stats['image']} ({size}{details})")
+            return "\n".join(lines)
+
+    def close(self):
+        """Closes the log."""
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,175 @@
+"""Persistent on-disk cache of image thumbnails.
+
+Thumbnails are stored as small PNG files named after a hash of the source path, its size and modification time and
+the thumbnail size. An edited source gets a new key, so stale thumbnails are never returned and simply age out. The
+cache folder is kept under a size cap by deleting the least recently used thumbnails first.
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+from PIL import Image
+
+# Default maximum size of the cache folder in bytes
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+# Modes thumbnails are stored in as they are, others like CMYK can't be saved as PNG and are converted to RGB(A)
+PNG_MODES = {"1", "L", "LA", "P", "RGB", "RGBA"}
+
+# Once the cap is exceeded, thumbnails are deleted until the cache is back under this fraction of the cap, so eviction
+# doesn't run again on the very next thumbnail
+EVICTION_TARGET = 0.8
+
+
+def get_default_cache_folder():
+    """Returns the per-user folder thumbnails are cached in, following the platform conventions."""
+    if sys.platform == "win32":
+        base = os.environ.get("LOCALAPPDATA", Path.home() / "AppData" / "Local")
+    elif sys.platform == "darwin":
+        base = Path.home() / "Library" / "Caches"
+    else:
+        base = os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")
+    return Path(base) / "mass-watermarker" / "thumbnails"
+
+
+class ThumbnailCache:
+    """Stores and retrieves thumbnails on disk. Safe to use from several threads.
+
+    Args:
+        folder (str, optional): Folder the thumbnails are stored in. Defaults to a per-user cache folder.
+        max_size (int, optional): Maximum total size of the cached thumbnails in bytes.
+    """
+
+    def __init__(self, folder=None, max_size=DEFAULT_MAX_SIZE):
+        self.folder = Path(folder) if folder else get_default_cache_folder()
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # Total size of the cache folder in bytes, measured the first time a thumbnail is stored
+        self._total_size = None
+
+    def get_key(self, image_path, size):
+        """Returns the cache key of the thumbnail of image_path fitted into size, or None if the source is missing.
+
+        Args:
+            image_path (str): Full path of the source image.
+            size (tuple): Maximum (width, height) of the thumbnail.
+
+        Returns:
+            str: Hex digest identifying the current content of the source and the thumbnail size.
+        """
+        try:
+            stat = os.stat(image_path)
+        except OSError:
+            return None
+        key = f"{os.path.abspath(image_path)}\0{stat.st_size}\0{stat.st_mtime_ns}\0{size[0]}x{size[1]}"
+        return hashlib.sha1(key.encode("utf-8", "surrogatepass")).hexdigest()
+
+    def get(self, image_path, size):
+        """Returns the cached thumbnail of image_path, or None if it isn't cached or the source changed since.
+
+        Args:
+            image_path (str): Full path of the source image.
+            size (tuple): Maximum (width, height) of the thumbnail.
+
+        Returns:
+            PIL Image: The cached thumbnail, or None.
+        """
+        key = self.get_key(image_path, size)
+        if key is None:
+            return None
+        cache_path = self._get_cache_path(key)
+        try:
+            with Image.open(cache_path) as thumbnail:
+                thumbnail.load()
+            # Mark the thumbnail as recently used for the LRU eviction
+            os.utime(cache_path)
+        except (OSError, SyntaxError, ValueError):
+            return None
+        return thumbnail
+
+    def put(self, image_path, size, thumbnail):
+        """Stores the thumbnail of image_path, evicting the least recently used thumbnails if the cache is full.
+
+        Args:
+            image_path (str): Full path of the source image.
+            size (tuple): Maximum (width, height) the thumbnail was fitted into.
+            thumbnail (PIL Image): The thumbnail to store.
+
+        Raises:
+            OSError: If the thumbnail can't be written. Nothing is left behind in the cache folder.
+        """
+        key = self.get_key(image_path, size)
+        if key is None:
+            return
+        if thumbnail.mode not in PNG_MODES:
+            has_alpha = "A" in thumbnail.getbands() or "transparency" in thumbnail.info
+            thumbnail = thumbnail.convert("RGBA" if has_alpha else "RGB")
+        cache_path = self._get_cache_path(key)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so other threads and processes never read a half written thumbnail
+        fd, temp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                thumbnail.save(file, format="PNG", compress_level=1)
+            os.replace(temp_path, cache_path)
+        except BaseException:
+            Path(temp_path).unlink(missing_ok=True)
+            raise
+        file_size = cache_path.stat().st_size
+
+        with self._lock:
+            if self._total_size is None:
+                self._total_size = self._measure()
+            else:
+                self._total_size += file_size
+            if self._total_size > self.max_size:
+                self._evict()
+
+    def clear(self):
+        """Deletes every cached thumbnail."""
+        with self._lock:
+            for cache_path in self._iter_files():
+                cache_path.unlink(missing_ok=True)
+            self._total_size = 0
+
+    def _get_cache_path(self, key):
+        # Spread thumbnails over sub folders so no single folder holds hundreds of thousands of files
+        return self.folder / key[:2] / f"{key}.png"
+
+    def _iter_files(self):
+        if self.folder.is_dir():
+            yield from self.folder.glob("*/*.png")
+
+    def _measure(self):
+        total_size = 0
+        for cache_path in self._iter_files():
+            try:
+                total_size += cache_path.stat().st_size
+            except OSError:
+                pass
+        return total_size
+
+    def _evict(self):
+        entries = []
+        for cache_path in self._iter_files():
+            try:
+                stat = cache_path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, cache_path))
+
+        # Delete least recently used thumbnails first
+        entries.sort()
+        total_size = sum(entry[1] for entry in entries)
+        for _, file_size, cache_path in entries:
+            if total_size <= self.max_size * EVICTION_TARGET:
+                break
+            try:
+                cache_path.unlink()
+            except OSError:
+                continue
+            total_size -= file_size
+        self._total_size = total_size
@@ -0,0 +1,514 @@
+"""GUI-free watermarking engine.
+
+Everything needed to render a watermark lives here so that the Tk app, the command line tool and worker processes
+can share the exact same code. Functions in this module never touch widgets or keep per-image state, so they can be
+called from any number of threads or processes at once.
+"""
+import os
+import threading
+from dataclasses import dataclass, replace
+from functools import lru_cache
+
+from PIL import Image, ImageDraw, ImageFont
+
+import compositing
+import telemetry
+
+# Watermark positions offered by the position radiobuttons. "tiled" repeats the watermark across the whole image.
+POSITIONS = ("bottom-left", "top-left", "bottom-right", "top-right", "center", "tiled")
+
+# Counter-clockwise right angle rotations and the transpose operation doing the same thing losslessly
+TRANSPOSE_ROTATIONS = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270,
+}
+
+# EXIF orientation tag and the counter-clockwise rotation that makes the image upright for each value
+EXIF_ORIENTATION = 0x0112
+EXIF_ORIENTATION_ROTATIONS = {3: 180, 6: 270, 8: 90}
+
+# Number of prepared watermark images kept in memory. Dragging the size or opacity slider creates a new entry for
+# every value, so keep enough to make going back and forth free.
+WATERMARK_CACHE_SIZE = 32
+
+# Number of loaded (font, size) pairs kept in memory, shared by the preview and the export
+FONT_CACHE_SIZE = 64
+
+# Number of prepared tiled watermark patterns kept in memory
+PATTERN_CACHE_SIZE = 16
+
+# Minimum width in pixels of a prepared tiled watermark pattern. Wider patterns cover an image in fewer blits.
+PATTERN_MIN_WIDTH = 2048
+
+# FreeType font objects are not safe to use from several threads at once
+_font_lock = threading.Lock()
+
+
+@dataclass(frozen=True)
+class WatermarkSpec:
+    """Immutable description of a watermark and where it should be placed.
+
+    Attributes:
+        mode (str): Either "image" or "text". Mirrors the tab selected on the tab_view widget.
+        image_watermark_path (str): Path of the image used as watermark when mode is "image".
+        text (str): Text used as watermark when mode is "text".
+        position (str): One of the values in POSITIONS.
+        image_watermark_size (tuple): Maximum (width, height) of the image watermark in pixels.
+        text_watermark_size (int): Font size of the text watermark.
+        margin (int): Distance in pixels between the watermark and the image border.
+        text_color (tuple): RGB value used to draw the text watermark.
+        font (str): Path of the TrueType font used to draw the text watermark.
+        opacity (int): Watermark opacity on a percent scale.
+        tile_spacing (int): Gap in pixels between the repeated watermarks when position is "tiled".
+        tile_angle (int): Counter-clockwise rotation in degrees of the repeated watermarks when position is "tiled".
+    """
+
+    mode: str = "image"
+    image_watermark_path: str = None
+    text: str = None
+    position: str = "bottom-left"
+    image_watermark_size: tuple = (300, 300)
+    text_watermark_size: int = 100
+    margin: int = 40
+    text_color: tuple = (255, 255, 255)
+    font: str = "fonts/Roboto-Regular.ttf"
+    opacity: int = 100
+    tile_spacing: int = 100
+    tile_angle: int = 30
+
+    @property
+    def has_watermark(self):
+        """bool: True if this spec would actually draw something on an image."""
+        if self.mode == "image":
+            return bool(self.image_watermark_path)
+        if self.mode == "text":
+            return bool(self.text)
+        return False
+
+    def with_changes(self, **changes):
+        """Returns a copy of this spec with the passed fields replaced."""
+        return replace(self, **changes)
+
+
+def rotate_image(image, rotate):
+    """Rotates the passed image counter-clockwise by the rotate value stored in image_dictionary.
+
+    Right angles are applied with a lossless transpose, which only moves pixels around instead of going through the
+    resampler, so a rotated image costs about the same to export as an unrotated one.
+
+    Args:
+        image (PIL Image): Image to rotate.
+        rotate (int): Counter-clockwise rotation in degrees, one of 0, 90, 180 or 270.
+
+    Returns:
+        PIL Image: The rotated image, or the passed image itself if no rotation is needed.
+    """
+    rotate %= 360
+    if rotate == 0:
+        return image
+    if rotate in TRANSPOSE_ROTATIONS:
+        return image.transpose(TRANSPOSE_ROTATIONS[rotate])
+    return image.rotate(angle=rotate, expand=True)
+
+
+def get_exif_rotation(image):
+    """Returns the counter-clockwise rotation that makes the passed image upright according to its EXIF orientation.
+
+    Mirrored orientations can't be expressed as a rotation and are treated as upright.
+
+    Args:
+        image (PIL Image): Opened image. Only its header is read.
+
+    Returns:
+        int: 0, 90, 180 or 270.
+    """
+    try:
+        orientation = image.getexif().get(EXIF_ORIENTATION, 1)
+    except Exception:
+        return 0
+    return EXIF_ORIENTATION_ROTATIONS.get(orientation, 0)
+
+
+def load_image(image_path, rotate=0, timer=None):
+    """Decodes the image on the passed path and applies the rotation stored for it. The file is closed once the
+    pixels are read.
+
+    Args:
+        image_path (str): Full path of the image to open.
+        rotate (int, optional): Counter-clockwise rotation in degrees. None uses the EXIF orientation of the image.
+            Defaults to 0.
+        timer (StageTimer, optional): Records the decode and rotate times when telemetry is on. Defaults to None.
+
+    Returns:
+        PIL Image: The decoded and rotated image.
+    """
+    with telemetry.stage(timer, "decode"):
+        with Image.open(image_path) as image:
+            if rotate is None:
+                rotate = get_exif_rotation(image)
+            image.load()
+    if timer is not None:
+        timer.details.update(format=image.format, mode=image.mode, width=image.width, height=image.height)
+    with telemetry.stage(timer, "rotate"):
+        return rotate_image(image, rotate)
+
+
+@lru_cache(maxsize=WATERMARK_CACHE_SIZE)
+def _prepare_image_watermark(path, mtime_ns, file_size, size, opacity):
+    # mtime_ns and file_size are only part of the cache key, so an edited watermark file is loaded again
+    with Image.open(path) as watermark:
+        # Adjust watermark size to be pasted based on the watermark_size value chosen by user. Default is 300px
+        watermark.thumbnail(size)
+        watermark.load()
+
+        # Adjust watermark opacity on a percent scale. Convert image to RGBA if it doesn't have transparency.
+        if watermark.mode != "RGBA":
+            watermark = watermark.convert("RGBA")
+            alpha = Image.new("L", watermark.size, 255)
+            watermark.putalpha(alpha)
+        paste_mask = watermark.split()[3].point(lambda i: i * opacity / 100.0)
+    return watermark, paste_mask
+
+
+def get_image_watermark(path, size, opacity):
+    """Returns the image watermark scaled to size together with the mask used to paste it at the given opacity.
+
+    The watermark file is decoded and prepared once per (path, modification time, size, opacity) and shared by every
+    image and preview that uses it afterwards. The returned images are shared, so they must not be modified.
+
+    Args:
+        path (str): Path of the image used as watermark.
+        size (tuple): Maximum (width, height) of the watermark in pixels.
+        opacity (int): Watermark opacity on a percent scale.
+
+    Returns:
+        tuple: (RGBA watermark image, L paste mask).
+    """
+    stat = os.stat(path)
+    return _prepare_image_watermark(path, stat.st_mtime_ns, stat.st_size, tuple(size), opacity)
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(font, size):
+    """Loads a TrueType font at the given size. Fonts are cached per (font file, size), so moving the size slider
+    back and forth or exporting many images never reads and parses the same font file twice.
+
+    Args:
+        font (str): Path of the TrueType font file.
+        size (int): Font size.
+
+    Returns:
+        FreeTypeFont: The loaded font.
+    """
+    return ImageFont.truetype(font, size)
+
+
+@lru_cache(maxsize=WATERMARK_CACHE_SIZE)
+def get_text_watermark(text, font, size, color, opacity):
+    """Renders the text watermark once into a sprite that is only as big as the drawn text.
+
+    Sprites are cached per (text, font, size, color, opacity), so the glyphs are drawn once no matter how many
+    images the text is applied to. The returned sprite is shared, so it must not be modified.
+
+    Args:
+        text (str): Text used as watermark.
+        font (str): Path of the TrueType font used to draw the text.
+        size (int): Font size of the text.
+        color (tuple): RGB value used to draw the text.
+        opacity (int): Watermark opacity on a percent scale.
+
+    Returns:
+        tuple: (RGBA sprite, (x, y) offset of the sprite from the text origin, (width, height) of the text used to
+        position it).
+    """
+    with _font_lock:
+        font = get_font(font, size)
+
+        # Calculate the size of text watermark input. The right/bottom edge of the bounding box drawn from (0, 0)
+        # matches the size returned by the removed ImageDraw.textsize method.
+        left, top, right, bottom = ImageDraw.Draw(Image.new("RGBA", (1, 1))).textbbox((0, 0), text=text, font=font)
+
+        # Make a blank image just big enough for the text, initialized to transparent text color
+        sprite = Image.new("RGBA", (max(1, right - left), max(1, bottom - top)), (255, 255, 255, 0))
+
+        # This will compute the correct alpha value based on the current percentage value of opacity slider.
+        R, G, B = color
+        A = int(255 * (opacity * 0.01))
+        ImageDraw.Draw(sprite).text(xy=(-left, -top), text=text, font=font, fill=(R, G, B, A))
+    return sprite, (left, top), (right, bottom)
+
+
+def get_watermark_position(image_size, watermark_size, position, margin):
+    """Calculates x and y positions where watermark will be placed based on the image or text watermark size.
+
+    Args:
+        image_size (tuple): (width, height) of the image the watermark is applied to.
+        watermark_size (tuple): (width, height) of the image or text watermark.
+        position (str): One of the values in POSITIONS.
+        margin (int): Distance in pixels between the watermark and the image border.
+
+    Returns:
+        tuple: A tuple containing (x, y) positions in pixels based on the image or text watermark size.
+    """
+    image_width, image_height = image_size
+    watermark_width, watermark_height = watermark_size
+
+    if position == "bottom-left":
+        return (margin, image_height - watermark_height - margin)
+    elif position == "top-left":
+        return (margin, margin)
+    elif position == "bottom-right":
+        return (image_width - watermark_width - margin, image_height - watermark_height - margin)
+    elif position == "top-right":
+        return (image_width - watermark_width - margin, margin)
+    elif position == "center":
+        return (
+            round(image_width * 0.50 - (watermark_width * 0.50)),
+            round(image_height * 0.50 - (watermark_height * 0.50)),
+        )
+    raise ValueError(f"Unknown watermark position: {position}")
+
+
+def get_watermark_sprite(spec):
+    """Returns the prepared watermark described by spec, shared by every image it is applied to.
+
+    Args:
+        spec (WatermarkSpec): Description of the watermark.
+
+    Returns:
+        tuple: (RGBA sprite, L paste mask or None to blend the sprite by its own alpha, (x, y) offset of the sprite
+        from the position of the watermark, (width, height) of the watermark used to position it), or None if spec
+        has nothing to draw.
+    """
+    if spec.mode == "image" and spec.image_watermark_path:
+        watermark, paste_mask = get_image_watermark(spec.image_watermark_path, spec.image_watermark_size, spec.opacity)
+        return watermark, paste_mask, (0, 0), watermark.size
+
+    elif spec.mode == "text" and spec.text:
+        sprite, offset, text_size = get_text_watermark(
+            spec.text, spec.font, spec.text_watermark_size, tuple(spec.text_color), spec.opacity
+        )
+        return sprite, None, offset, text_size
+    return None
+
+
+def get_watermark_placement(image_size, spec):
+    """Prepares the watermark described by spec for an image of image_size and finds where it goes. Not used for the
+    "tiled" position, which places the watermark many times.
+
+    Args:
+        image_size (tuple): (width, height) of the image the watermark is applied to.
+        spec (WatermarkSpec): Description of the watermark to apply.
+
+    Returns:
+        tuple: (RGBA sprite, L paste mask or None to blend the sprite by its own alpha, (x, y) position of the sprite),
+        or None if spec has nothing to draw.
+    """
+    sprite = get_watermark_sprite(spec)
+    if sprite is None:
+        return None
+    sprite, paste_mask, (left, top), size = sprite
+    x, y = get_watermark_position(image_size, size, spec.position, spec.margin)
+    return sprite, paste_mask, (x + left, y + top)
+
+
+def get_pattern(spec):
+    """Returns the tiled watermark pattern described by spec, rendered once and shared by every image it is applied
+    to.
+
+    The watermark is rotated by spec.tile_angle and repeated in rows spec.tile_spacing apart, every other row shifted
+    by half a watermark, into a strip two rows high that repeats seamlessly in both directions. The returned images are
+    shared, so they must not be modified.
+
+    Args:
+        spec (WatermarkSpec): Description of the watermark.
+
+    Returns:
+        tuple: (RGBA strip, L paste mask of the strip or None to blend the strip by its own alpha, (width, height) of
+        one repeated watermark including spacing), or None if spec has nothing to draw.
+    """
+    if not spec.has_watermark:
+        return None
+    # Neither the position nor the margin change the pattern, so every tiled spec only differing by them shares it
+    spec = spec.with_changes(position="tiled", margin=0)
+    if spec.mode == "image":
+        stat = os.stat(spec.image_watermark_path)
+        return _prepare_pattern(spec, stat.st_mtime_ns, stat.st_size)
+    return _prepare_pattern(spec, None, None)
+
+
+@lru_cache(maxsize=PATTERN_CACHE_SIZE)
+def _prepare_pattern(spec, mtime_ns, file_size):
+    # mtime_ns and file_size are only part of the cache key, so an edited watermark file is prepared again
+    sprite, paste_mask, _, _ = get_watermark_sprite(spec)
+    # Rotate with premultiplied alpha, so the transparent pixels around the watermark don't darken its edges
+    sprite = sprite.convert("RGBa").rotate(spec.tile_angle, Image.Resampling.BICUBIC, expand=True).convert("RGBA")
+    if paste_mask is not None:
+        paste_mask = paste_mask.rotate(spec.tile_angle, Image.Resampling.BICUBIC, expand=True)
+
+    spacing = max(0, spec.tile_spacing)
+    cell_width, cell_height = sprite.width + spacing, sprite.height + spacing
+    strip_size = (-(-PATTERN_MIN_WIDTH // cell_width) * cell_width, cell_height * 2)
+    strip = Image.new("RGBA", strip_size, (0, 0, 0, 0))
+    strip_mask = None if paste_mask is None else Image.new("L", strip_size, 0)
+    # The shifted row starts half a watermark left of the strip, so its first and last watermarks are cut at the
+    # edges and join up when the strip is repeated
+    for row, shift in ((0, 0), (1, -(cell_width // 2))):
+        for x in range(shift, strip_size[0], cell_width):
+            position = (x + spacing // 2, row * cell_height + spacing // 2)
+            # Watermarks never overlap, so they are copied rather than blended
+            strip.paste(sprite, position)
+            if strip_mask is not None:
+                strip_mask.paste(paste_mask, position)
+    return strip, strip_mask, (cell_width, cell_height)
+
+
+def get_watermark_box(image_size, spec):
+    """Returns the (left, top, right, bottom) box of the pixels the watermark described by spec covers on an image of
+    image_size, or None if it covers none of them."""
+    if spec.position == "tiled":
+        return (0, 0) + tuple(image_size) if spec.has_watermark else None
+    placement = get_watermark_placement(image_size, spec)
+    if placement is None:
+        return None
+    sprite, _, (x, y) = placement
+    box = (max(0, x), max(0, y), min(image_size[0], x + sprite.width), min(image_size[1], y + sprite.height))
+    return box if box[0] < box[2] and box[1] < box[3] else None
+
+
+def composite_watermark(image, spec, offset=(0, 0), image_size=None):
+    """Draws the watermark described by spec on the passed image in place, only touching the pixels it covers.
+
+    Args:
+        image (PIL Image): RGB or RGBA image where the watermark will be applied to.
+        spec (WatermarkSpec): Description of the watermark to apply.
+        offset (tuple, optional): (x, y) position of image within the full image when image is only a part of it, e.g.
+            a band of rows. Defaults to (0, 0).
+        image_size (tuple, optional): (width, height) of the full image. Defaults to the size of image.
+    """
+    image_size = image_size or image.size
+    if spec.position == "tiled":
+        _composite_pattern(image, spec, offset, image_size)
+        return
+    placement = get_watermark_placement(image_size, spec)
+    if placement is None:
+        return
+    sprite, paste_mask, (x, y) = placement
+    _blend(image, sprite, (x - offset[0], y - offset[1]), paste_mask)
+
+
+def _composite_pattern(image, spec, offset, image_size):
+    pattern = get_pattern(spec)
+    if pattern is None:
+        return
+    strip, strip_mask, (cell_width, cell_height) = pattern
+    # Center one of the watermarks on the image, then start from the last strip above and left of the image
+    x0 = round(image_size[0] / 2 - cell_width / 2) % strip.width - strip.width
+    y0 = round(image_size[1] / 2 - cell_height / 2) % strip.height - strip.height
+    left, top = offset
+    right, bottom = left + image.width, top + image.height
+    # Only blit the strips that overlap the part of the image that is passed
+    for y in range(y0 + (max(0, top - y0) // strip.height) * strip.height, bottom, strip.height):
+        for x in range(x0 + (max(0, left - x0) // strip.width) * strip.width, right, strip.width):
+            _blend(image, strip, (x - left, y - top), strip_mask)
+
+
+def _blend(image, sprite, position, paste_mask):
+    if paste_mask is not None:
+        compositing.paste_with_mask(image, sprite, position, paste_mask)
+    else:
+        # Blend the text over the image, only where the text is actually drawn
+        compositing.alpha_composite_over(image, sprite, position)
+
+
+def apply_watermark(image, spec):
+    """Applies the watermark described by spec to a copy of the passed image.
+
+    Args:
+        image (PIL Image): Image where the watermark will be applied to. It is never modified.
+        spec (WatermarkSpec): Description of the watermark to apply.
+
+    Returns:
+        PIL Image: Returns a new RGBA PIL Image Object of the image with applied watermark.
+    """
+    # convert() always returns a new image, so the caller's image is never modified
+    watermarked_image = image.convert("RGBA")
+    composite_watermark(watermarked_image, spec)
+    return watermarked_image
+
+
+def render_preview(preview_image, original_size, spec):
+    """Applies the watermark to a downscaled preview of an image so that it looks exactly like the watermark applied
+    to the full resolution original, scaled down. Watermark size, text size and margin are scaled by the same factor
+    as the preview, so slider changes only ever composite preview sized images.
+
+    Args:
+        preview_image (PIL Image): Downscaled and rotated copy of the original image.
+        original_size (tuple): (width, height) of the rotated original image.
+        spec (WatermarkSpec): Description of the watermark as applied to the original image.
+
+    Returns:
+        PIL Image: Returns a new RGBA PIL Image Object of the preview with applied watermark.
+    """
+    scale = preview_image.width / original_size[0]
+    preview_spec = spec.with_changes(
+        text_watermark_size=max(1, round(spec.text_watermark_size * scale)),
+        margin=round(spec.margin * scale),
+        tile_spacing=round(spec.tile_spacing * scale),
+    )
+    if spec.mode == "image" and spec.image_watermark_path:
+        # The watermark is never enlarged, so scale the size it really has on the original rather than the maximum
+        # size chosen with the slider
+        watermark, _ = get_image_watermark(spec.image_watermark_path, spec.image_watermark_size, spec.opacity)
+        preview_spec = preview_spec.with_changes(
+            image_watermark_size=(max(1, round(watermark.width * scale)), max(1, round(watermark.height * scale)))
+        )
+    return apply_watermark(preview_image, preview_spec)
+
+
+def watermark_image(image, spec, mode="RGBA", timer=None):
+    """Watermarks an image returned by load_image. The image is handed over to this function and may be modified in
+    place, so it must not be used by the caller afterwards.
+
+    Args:
+        image (PIL Image): Decoded image where the watermark will be applied to.
+        spec (WatermarkSpec): Description of the watermark to apply.
+        mode (str, optional): Mode of the returned image, "RGBA" or "RGB". Defaults to "RGBA".
+        timer (StageTimer, optional): Records the convert and composite times when telemetry is on. Defaults to None.
+
+    Returns:
+        PIL Image: Returns a PIL Image Object of the image with applied watermark.
+    """
+    # An image already in the returned mode can be watermarked in place instead of going through full size RGBA
+    # copies. Blending into RGB gives the same pixels as blending into RGBA and dropping the alpha channel afterwards.
+    if image.mode == mode:
+        with telemetry.stage(timer, "composite"):
+            composite_watermark(image, spec)
+        return image
+
+    # Same as apply_watermark, with the conversions timed apart from the compositing
+    with telemetry.stage(timer, "convert"):
+        watermarked_image = image.convert("RGBA")
+    with telemetry.stage(timer, "composite"):
+        composite_watermark(watermarked_image, spec)
+    if mode == "RGBA":
+        return watermarked_image
+    with telemetry.stage(timer, "convert"):
+        return watermarked_image.convert(mode)
+
+
+def watermark_file(image_path, spec, rotate=0, mode="RGBA"):
+    """Opens, rotates and watermarks the image on the passed path.
+
+    Args:
+        image_path (str): Full path of the image where the watermark will be applied to.
+        spec (WatermarkSpec): Description of the watermark to apply.
+        rotate (int, optional): Counter-clockwise rotation in degrees. None uses the EXIF orientation of the image.
+            Defaults to 0.
+        mode (str, optional): Mode of the returned image, "RGBA" or "RGB". Defaults to "RGBA".
+
+    Returns:
+        PIL Image: Returns a PIL Image Object of the image with applied watermark.
+    """
+    return watermark_image(load_image(image_path, rotate), spec, mode)
@@ -0,0 +1,456 @@
+"""Command line batch watermarker.
+
+Applies the same watermark the Mass Watermarker app would to every image found in the input files, folders or glob
+patterns, without needing a display. Example:
+
+    python -m watermarker photos/ "shoots/**/*.jpg" output/ --text "(c) Studio" --position bottom-right --opacity 60
+
+Add --save-job job.json to write the images and settings to a job file instead, and run it later with
+--job job.json. Job files saved from the app work the same way.
+
+With --watch, the watermarker keeps running and exports every image that lands in a folder until it is stopped with
+Ctrl+C or SIGTERM, e.g. with the settings of a job saved from the app:
+
+    python -m watermarker --job studio.json --watch incoming/ --metrics watch_metrics.json
+"""
+import argparse
+import glob
+import os
+import signal
+import sys
+import time
+from pathlib import Path
+
+from batch_export import DEFAULT_MEMORY_BUDGET, BatchExporter
+from folder_watcher import SETTLE_TIME, FolderWatcher, write_metrics
+from font_catalog import FontCatalog
+from job_file import Job, load_job, save_job
+from output_profiles import DEFAULT_PROFILE, OUTPUT_PROFILES
+from telemetry import ENV_VAR, Telemetry
+from watermark_engine import POSITIONS, WatermarkSpec
+
+# Same file types accepted by the Add Image(s) file dialog
+IMAGE_EXTENSIONS = {".png", ".jpeg", ".jpg", ".bmp", ".gif", ".webp", ".tif", ".tiff", ".ppm"}
+
+# Defaults of the watermark options, which are None when not given so they can override the settings of --job
+DEFAULT_SIZE = 300
+DEFAULT_FONT = "Roboto-Regular"
+
+# Watermark options copied as they are to the WatermarkSpec field of the same meaning
+SPEC_OPTIONS = {
+    "position": "position",
+    "margin": "margin",
+    "color": "text_color",
+    "font": "font",
+    "opacity": "opacity",
+    "tile_spacing": "tile_spacing",
+    "tile_angle": "tile_angle",
+}
+
+# Seconds between two throughput reports
+REPORT_INTERVAL = 2.0
+
+
+def iter_image_paths(inputs, recursive=False):
+    """Lazily yields every image path found in inputs, so huge folders are never listed up front.
+
+    Args:
+        inputs (list): Image files, folders or glob patterns.
+        recursive (bool, optional): Whether to also look inside sub folders of folders. Defaults to False.
+
+    Yields:
+        str: Path of an image to watermark. Images matched by more than one input are only yielded once.
+    """
+    seen = set()
+    for path in _iter_inputs(inputs, recursive):
+        real_path = os.path.realpath(path)
+        if real_path not in seen:
+            seen.add(real_path)
+            yield path
+
+
+def _iter_inputs(inputs, recursive):
+    for item in inputs:
+        if os.path.isdir(item):
+            yield from _iter_folder(item, recursive)
+        elif glob.has_magic(item):
+            for path in glob.iglob(item, recursive=True):
+                if os.path.isfile(path) and Path(path).suffix.lower() in IMAGE_EXTENSIONS:
+                    yield path
+        elif os.path.isfile(item):
+            yield item
+        else:
+            print(f"Skipped {item}: no such file or folder", file=sys.stderr)
+
+
+def _iter_folder(folder, recursive):
+    with os.scandir(folder) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                if recursive:
+                    yield from _iter_folder(entry.path, recursive)
+            elif Path(entry.name).suffix.lower() in IMAGE_EXTENSIONS:
+                yield entry.path
+
+
+def parse_color(value):
+    """Parses a text color given as "#rrggbb" or "r,g,b".
+
+    Returns:
+        tuple: The (R, G, B) value of the color.
+    """
+    try:
+        if value.startswith("#") and len(value) == 7:
+            return tuple(int(value[i : i + 2], 16) for i in (1, 3, 5))
+        color = tuple(int(channel) for channel in value.split(","))
+    except ValueError:
+        color = ()
+    if len(color) != 3 or not all(0 <= channel <= 255 for channel in color):
+        raise argparse.ArgumentTypeError(f"invalid color {value!r}, use #rrggbb or r,g,b")
+    return color
+
+
+def get_font_path(font):
+    """Resolves a font name from the font option menu, e.g. "Roboto-Regular", or a path to a .ttf file."""
+    if Path(font).suffix.lower() == ".ttf":
+        return font
+    try:
+        return FontCatalog().path(font)
+    except KeyError:
+        raise argparse.ArgumentTypeError(f"unknown font {font!r}, see --list-fonts") from None
+
+
+class ListFontsAction(argparse.Action):
+    """Prints the bundled fonts with their family and style, then exits like --help does."""
+
+    def __init__(self, option_strings, dest, **kwargs):
+        super().__init__(option_strings, dest, nargs=0, default=argparse.SUPPRESS, **kwargs)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        catalog = FontCatalog()
+        for name in catalog.names:
+            metadata = catalog.metadata(name)
+            print(f"{name:<28} {metadata['family']} ({metadata['style']})")
+        parser.exit()
+
+
+def build_spec(args, spec=None):
+    """Builds the WatermarkSpec described by the parsed command line arguments.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments. Watermark options that weren't given are None.
+        spec (WatermarkSpec, optional): Spec of the --job file, whose settings the given options override. Defaults to
+            a spec with the defaults of the command line.
+
+    Returns:
+        WatermarkSpec: The watermark to apply.
+    """
+    if spec is None:
+        spec = WatermarkSpec(
+            image_watermark_size=(DEFAULT_SIZE, DEFAULT_SIZE),
+            text_watermark_size=int(DEFAULT_SIZE * 0.50),
+            font=get_font_path(DEFAULT_FONT),
+        )
+    changes = {
+        name: getattr(args, option) for option, name in SPEC_OPTIONS.items() if getattr(args, option) is not None
+    }
+    if args.text:
+        changes.update(mode="text", text=args.text)
+    if args.image:
+        changes.update(mode="image", image_watermark_path=args.image)
+    if args.size is not None:
+        # Same conversion as the watermark size slider: text is drawn at half the size to avoid it being too big
+        changes.update(image_watermark_size=(args.size, args.size), text_watermark_size=int(args.size * 0.50))
+    return spec.with_changes(**changes)
+
+
+def report_replaced(result):
+    """Warns that an exported image overwrote the output of another source, recorded in the export manifest."""
+    for other_source in result.replaced:
+        print(
+            f"{result.output_path} was the export of {other_source}, replaced by {result.image_path}", file=sys.stderr
+        )
+
+
+def watch_folder(args, exporter):
+    """Exports the images landing in the --watch folder until the watermarker is stopped with Ctrl+C or SIGTERM.
+
+    Returns:
+        int: Exit code of the watermarker.
+    """
+    watcher = FolderWatcher(
+        args.watch,
+        exporter,
+        IMAGE_EXTENSIONS,
+        rotate=0 if args.ignore_exif_orientation else None,
+        recursive=args.recursive,
+        polling=args.poll,
+        settle_time=args.settle_time,
+    )
+    last_status = None
+
+    def report_progress(count, result):
+        if not result.ok:
+            print(f"Failed {result.image_path}: {result.error}", file=sys.stderr)
+        elif not result.skipped:
+            print(f"Exported {result.image_path}", flush=True)
+        report_replaced(result)
+
+    def report_metrics(metrics):
+        nonlocal last_status
+        if args.metrics:
+            write_metrics(metrics, args.metrics)
+        # Only print the status when it changed, so an idle watcher doesn't fill its log
+        status = (metrics["queue_depth"], metrics["exported"], metrics["skipped"], metrics["failed"])
+        if status != last_status:
+            last_status = status
+            print(
+                f"{metrics['queue_depth']} queued, {metrics['exported']} exported, {metrics['skipped']} up to date, "
+                f"{metrics['failed']} failed, {metrics['images_per_second']:.1f} images/s",
+                flush=True,
+            )
+
+    # Stop on Ctrl+C or on SIGTERM from a service manager, after the images being exported are saved
+    handlers = {signum: signal.signal(signum, lambda *_: watcher.stop()) for signum in (signal.SIGINT, signal.SIGTERM)}
+    print(f"Watching {args.watch} for images, saving to {exporter.save_location}. Press Ctrl+C to stop.", flush=True)
+    try:
+        watcher.run(on_progress=report_progress, on_metrics=report_metrics)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    print(f"Stopped watching {args.watch}")
+    return 0
+
+
+def export_batch(exporter, tasks):
+    """Exports the images of the batch, reporting the progress every REPORT_INTERVAL seconds.
+
+    Returns:
+        int: Exit code of the watermarker.
+    """
+    start = last_report = time.perf_counter()
+    completed = failed = skipped = 0
+
+    def report_progress(count, result):
+        nonlocal completed, failed, skipped, last_report
+        completed = count
+        skipped += result.skipped
+        if not result.ok:
+            failed += 1
+            print(f"Failed {result.image_path}: {result.error}", file=sys.stderr)
+        report_replaced(result)
+        now = time.perf_counter()
+        if now - last_report >= REPORT_INTERVAL:
+            last_report = now
+            print(
+                f"{completed} images, {completed / (now - start):.1f} images/s, {skipped} up to date, {failed} failed",
+                flush=True,
+            )
+
+    try:
+        exporter.run(tasks, on_progress=report_progress)
+    except KeyboardInterrupt:
+        print(f"Cancelled after {completed} images", file=sys.stderr)
+        return 130
+
+    elapsed = time.perf_counter() - start
+    rate = completed / elapsed if elapsed else 0.0
+    print(f"Done: {completed} images in {elapsed:.1f}s ({rate:.1f} images/s), {skipped} up to date, {failed} failed")
+    return 1 if failed else 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="watermarker", description="Apply a text or image watermark to a batch of images."
+    )
+    parser.add_argument(
+        "paths",
+        nargs="*",
+        metavar="inputs... output",
+        help="image files, folders or glob patterns to watermark, then the folder watermarked images are saved to",
+    )
+    parser.add_argument(
+        "--job",
+        help="run the images and settings of a JSON or TOML job file. Watermark options given with it override the "
+        "settings of the job",
+    )
+    parser.add_argument("--save-job", metavar="FILE", help="write the job to a JSON job file instead of running it")
+
+    # One of them is required unless the watermark comes from --job
+    watermark = parser.add_mutually_exclusive_group()
+    watermark.add_argument("--text", help="text used as watermark")
+    watermark.add_argument("--image", help="path of the image used as watermark")
+
+    # The watermark options override the settings of --job when given with it
+    defaults = WatermarkSpec()
+    parser.add_argument("--position", choices=POSITIONS, help=f"default: {defaults.position}")
+    parser.add_argument(
+        "--size",
+        type=int,
+        help=f"watermark size, same scale as the size slider (100-700). Default: {DEFAULT_SIZE}",
+    )
+    parser.add_argument(
+        "--opacity", type=int, help=f"watermark opacity in percent (10-100). Default: {defaults.opacity}"
+    )
+    parser.add_argument(
+        "--margin", type=int, help=f"distance from the image border in pixels. Default: {defaults.margin}"
+    )
+    parser.add_argument(
+        "--tile-spacing",
+        type=int,
+        help=f"gap in pixels between the watermarks of the tiled position. Default: {defaults.tile_spacing}",
+    )
+    parser.add_argument(
+        "--tile-angle",
+        type=int,
+        help=f"counter-clockwise rotation in degrees of the tiled watermarks. Default: {defaults.tile_angle}",
+    )
+    parser.add_argument(
+        "--font",
+        type=get_font_path,
+        help=f"font name from the fonts folder or a .ttf path. Default: {DEFAULT_FONT}",
+    )
+    parser.add_argument("--list-fonts", action=ListFontsAction, help="list the bundled fonts and exit")
+    parser.add_argument("--color", type=parse_color, help="text color, #rrggbb or r,g,b. Default: white")
+    parser.add_argument("--jobs", "-j", type=int, default=None, help="worker processes, defaults to CPU count")
+    parser.add_argument(
+        "--memory-budget",
+        type=int,
+        default=DEFAULT_MEMORY_BUDGET // (1024 * 1024),
+        help="memory in MB the images being exported may use at the same time. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--profile",
+        choices=OUTPUT_PROFILES,
+        help=f"output format and encoder settings. Default: {DEFAULT_PROFILE.name}, or the profile of --job",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="export every image again, even if its output is already up to date",
+    )
+    parser.add_argument(
+        "--telemetry",
+        metavar="LOG",
+        default=os.environ.get(ENV_VAR),
+        help=f"append per-image stage timings to this JSON lines log and print a per-stage summary. "
+        f"Defaults to the {ENV_VAR} environment variable",
+    )
+    parser.add_argument(
+        "--large-images",
+        action="store_true",
+        help="allow images over PIL's decompression bomb limit and watermark uncompressed TIFF, BMP and PPM files "
+        "without decoding them whole",
+    )
+    parser.add_argument("--recursive", "-r", action="store_true", help="also watermark images in sub folders")
+    parser.add_argument(
+        "--watch",
+        metavar="FOLDER",
+        help="keep running and watermark every image that lands in FOLDER. Takes only the output folder as argument",
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        help="with --watch, scan the folder every second instead of using inotify, e.g. for network shares",
+    )
+    parser.add_argument(
+        "--settle-time",
+        type=float,
+        default=SETTLE_TIME,
+        help="with --watch, seconds a file must stay unchanged before it is watermarked. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="with --watch, keep the queue depth, throughput and latency of the watcher in this JSON file",
+    )
+    parser.add_argument(
+        "--ignore-exif-orientation",
+        action="store_true",
+        help="don't rotate images according to their EXIF orientation, and save them with an upright orientation tag",
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.size is not None and not 100 <= args.size <= 700:
+        parser.error("--size must be between 100 and 700")
+    if args.opacity is not None and not 10 <= args.opacity <= 100:
+        parser.error("--opacity must be between 10 and 100")
+    if args.memory_budget < 1:
+        parser.error("--memory-budget must be at least 1 MB")
+    if args.watch and not os.path.isdir(args.watch):
+        parser.error(f"watched folder not found: {args.watch}")
+    if args.watch and args.save_job:
+        parser.error("--watch can't be combined with --save-job")
+    if args.settle_time < 0:
+        parser.error("--settle-time can't be negative")
+
+    if args.job:
+        if args.paths:
+            parser.error("--job can't be combined with inputs or output")
+        try:
+            job = load_job(args.job)
+        except (OSError, ValueError) as error:
+            parser.error(f"could not load job: {error}")
+        job.spec = build_spec(args, job.spec)
+        job.profile = args.profile or job.profile
+        job.workers = args.jobs or job.workers
+        tasks = job.images
+    else:
+        if args.watch and len(args.paths) != 1:
+            parser.error("--watch expects the output folder as only argument")
+        if not args.watch and len(args.paths) < 2:
+            parser.error("expected one or more inputs followed by the output folder")
+        if not (args.text or args.image):
+            parser.error("one of the arguments --text --image is required")
+        job = Job(
+            spec=build_spec(args),
+            save_location=args.paths[-1],
+            profile=args.profile or DEFAULT_PROFILE.name,
+            workers=args.jobs,
+        )
+        # A rotation of None makes the workers read it from the EXIF orientation of each image
+        rotate = 0 if args.ignore_exif_orientation else None
+        tasks = ((path, rotate) for path in iter_image_paths(args.paths[:-1], args.recursive))
+
+    spec = job.spec
+    if spec.mode == "text" and not os.path.isfile(spec.font):
+        parser.error(f"font not found: {spec.font}")
+    if spec.mode == "image" and not os.path.isfile(spec.image_watermark_path or ""):
+        parser.error(f"watermark image not found: {spec.image_watermark_path}")
+
+    if args.watch and os.path.realpath(args.watch) == os.path.realpath(job.save_location):
+        parser.error("the output folder can't be the watched folder")
+
+    if args.save_job:
+        job.images = list(tasks)
+        save_job(job, args.save_job)
+        print(f"Saved job with {len(job.images)} images to {args.save_job}")
+        return 0
+
+    # The exporter only closes the telemetry it opens itself, so the --telemetry log is closed here, on Ctrl+C too
+    telemetry = Telemetry(args.telemetry) if args.telemetry else None
+    try:
+        exporter = BatchExporter(
+            spec,
+            job.save_location,
+            workers=job.workers,
+            memory_budget=args.memory_budget * 1024 * 1024,
+            profile=OUTPUT_PROFILES[job.profile],
+            resume=not args.force,
+            telemetry=telemetry,
+            large_images=args.large_images,
+        )
+        if args.watch:
+            return watch_folder(args, exporter)
+        return export_batch(exporter, tasks)
+    finally:
+        if telemetry:
+            telemetry.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())